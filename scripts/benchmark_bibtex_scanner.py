@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+# Compares the streaming BibTeX scanner with the previous bibtexparser
+# based key extraction on a generated bibliography.
+# usage: scripts/benchmark_bibtex_scanner.py [number_of_entries]
+
+import os, os.path, sys, time, tempfile, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from setzer.helpers.bibtex_scanner import BibTeXScanner
+
+try:
+    import bibtexparser
+except ImportError:
+    bibtexparser = None
+
+
+def generate_bibliography(filename, number_of_entries):
+    with open(filename, 'w') as f:
+        f.write('@string{jacm = "Journal of the {ACM}"}\n\n')
+        f.write('@preamble{"\\newcommand{\\noopsort}[1]{}"}\n\n')
+        for i in range(number_of_entries):
+            if i % 100 == 0:
+                f.write('@comment{ generated block ' + str(i) + ' }\n\n')
+            f.write('@article{key' + str(i) + ',\n')
+            f.write('  author = {Doe, Jane and M{\\"u}ller, Hans and Author' + str(i) + ', A.},\n')
+            f.write('  title = {On the {Structure} of Problem ' + str(i) + '},\n')
+            f.write('  journal = jacm,\n')
+            f.write('  year = ' + str(1950 + i % 70) + ',\n')
+            f.write('  volume = {' + str(i % 50) + '},\n')
+            f.write('  pages = {' + str(i % 300) + '--' + str(i % 300 + 12) + '},\n')
+            f.write('  abstract = {' + 'Lorem ipsum dolor sit amet. ' * 8 + '}\n')
+            f.write('}\n\n')
+
+
+def keys_with_bibtexparser(filename):
+    with open(filename, 'r') as f:
+        db = bibtexparser.load(f)
+    bibitems = set()
+    for match in db.entries:
+        bibitems = bibitems | {match['ID']}
+    return bibitems
+
+
+def keys_with_scanner(filename):
+    bibitems = set()
+    with open(filename, 'r') as f:
+        for entry in BibTeXScanner().scan_file(f):
+            bibitems.add(entry['key'])
+    return bibitems
+
+
+def entries_with_scanner(filename):
+    bibitems = set()
+    with open(filename, 'r') as f:
+        for entry in BibTeXScanner(['title', 'author']).scan_file(f):
+            bibitems.add((entry['key'], entry['fields'].get('title'), entry['fields'].get('author')))
+    return bibitems
+
+
+def measure(name, function, filename):
+    start_time = time.time()
+    result = function(filename)
+    duration = time.time() - start_time
+
+    # separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    function(filename)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('{:<24} {:>8.2f} s {:>10.1f} MB peak {:>8} entries'.format(name, duration, peak_memory / 1000000, len(result)))
+    return result
+
+
+number_of_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+filename = os.path.join(tempfile.mkdtemp(), 'benchmark.bib')
+generate_bibliography(filename, number_of_entries)
+print('{} entries, {:.1f} MB'.format(number_of_entries, os.path.getsize(filename) / 1000000))
+
+keys = measure('scanner (keys)', keys_with_scanner, filename)
+measure('scanner (title, author)', entries_with_scanner, filename)
+if bibtexparser != None:
+    keys_bibtexparser = measure('bibtexparser', keys_with_bibtexparser, filename)
+    if keys != keys_bibtexparser:
+        print('results differ')
+else:
+    print('bibtexparser not installed, skipping')
+
+os.remove(filename)
+os.rmdir(os.path.dirname(filename))
+
+
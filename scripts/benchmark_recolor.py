@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+# Compares the in place dark mode recoloring with the previous PIL based
+# one on A4 pages rendered at 2x HiDPI. Each variant runs in its own
+# process, so the peak RSS numbers don't affect each other.
+# usage: scripts/benchmark_recolor.py [number_of_pages]
+
+import os, os.path, sys, time, resource, subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from setzer.helpers.surface_recolor import SurfaceRecolor
+
+try:
+    import cairo
+except ImportError:
+    cairo = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# A4 at 100% zoom and 2x HiDPI, in device pixels
+width, height = 1190, 1684
+color = (0.87, 0.87, 0.87, 1.0)
+
+
+class BufferSurface():
+    ''' Stands in for cairo.ImageSurface if pycairo isn't installed. '''
+
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.data = bytearray(width * height * 4)
+
+    def get_width(self): return self.width
+    def get_height(self): return self.height
+    def get_stride(self): return self.width * 4
+    def get_data(self): return memoryview(self.data)
+    def flush(self): pass
+    def mark_dirty(self): pass
+
+
+def create_page():
+    if cairo != None:
+        surface = cairo.ImageSurface(cairo.Format.ARGB32, width, height)
+    else:
+        surface = BufferSurface(width, height)
+
+    # white page with some black text lines
+    pixels = np.ndarray((height, surface.get_stride() // 4, 4), dtype=np.uint8, buffer=surface.get_data())
+    pixels[:] = 255
+    for y in range(150, height - 150, 40):
+        pixels[y:y + 16, 140:width - 140, :3] = np.random.randint(0, 256, (16, width - 280, 1), dtype=np.uint8) // 2
+    return surface
+
+
+def recolor_with_pil(surface):
+    pil_img = Image.frombuffer("RGBA", (width, height), surface.get_data(), "raw", "RGBA", 0, 1)
+
+    img_data = np.array(pil_img, dtype=np.ubyte)
+    alpha = 255 - 0.3 * img_data[..., 0] - 0.6 * img_data[..., 1] - 0.1 * img_data[..., 2]
+    img_data[:,:,-1] = alpha
+    pil_img = Image.fromarray(np.ubyte(img_data))
+
+    im_bytes = bytearray(pil_img.tobytes('raw', 'BGRa'))
+    if cairo != None:
+        surface = cairo.ImageSurface.create_for_data(im_bytes, cairo.FORMAT_ARGB32, width, height)
+        temp_ctx = cairo.Context(surface)
+        temp_ctx.set_source_rgba(*color)
+        temp_ctx.set_operator(cairo.Operator.IN)
+        temp_ctx.rectangle(0, 0, width, height)
+        temp_ctx.fill()
+    else:
+        surface = BufferSurface(width, height)
+        surface.data = im_bytes
+    return surface
+
+
+def get_channels(surface):
+    return np.frombuffer(bytes(surface.get_data()), dtype=np.uint8).reshape(height, surface.get_stride() // 4, 4)[:, :width]
+
+
+def check_against_pil():
+    ''' Both variants have to give the same page, up to rounding. Without
+        pycairo the PIL variant can't apply the color, only the alpha
+        channel (the last byte on little endian machines) is compared. '''
+
+    surface = create_page()
+    expected = get_channels(recolor_with_pil(surface)).astype(np.int16)
+    SurfaceRecolor().recolor(surface, color)
+    result = get_channels(surface).astype(np.int16)
+
+    if cairo == None:
+        alpha_index = 3 if np.little_endian else 0
+        expected = np.round(expected[..., alpha_index] * color[3])
+        result = result[..., alpha_index]
+    difference = int(np.max(np.abs(result - expected)))
+    print('largest difference to the pil variant: {}'.format(difference))
+    return difference <= 1
+
+
+def run_variant(variant, number_of_pages):
+    pages = [create_page() for i in range(number_of_pages)]
+    recolor = SurfaceRecolor()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start_time = time.time()
+    for surface in pages:
+        if variant == 'pil':
+            recolor_with_pil(surface)
+        else:
+            recolor.recolor(surface, color)
+    duration = time.time() - start_time
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('{:<10} {:>8.1f} ms/page {:>8.1f} MB peak RSS increase'.format(variant, duration * 1000 / number_of_pages, (rss_after - rss_before) / 1000))
+
+
+if len(sys.argv) > 2 and sys.argv[1] == '--variant':
+    run_variant(sys.argv[2], int(sys.argv[3]))
+else:
+    number_of_pages = sys.argv[1] if len(sys.argv) > 1 else '20'
+    print('{} pages of {}x{} px, {}'.format(number_of_pages, width, height, 'pycairo' if cairo != None else 'pycairo not installed, using plain buffers'))
+    if Image == None:
+        print('Pillow not installed, skipping the pil variant')
+    for variant in (['pil', 'in place'] if Image != None else ['in place']):
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--variant', variant, number_of_pages])
+
+    # after the variants, children inherit the peak RSS of this process.
+    if Image != None and not check_against_pil():
+        print('the in place result differs from the pil one by more than 1')
+        sys.exit(1)
@@ -17,35 +17,49 @@
 
 import gi
 gi.require_version('Gtk', '4.0')
-from gi.repository import GObject
+from gi.repository import Gio, GLib
 
-import os.path, re, time, bibtexparser
+import os, os.path, re, time, hashlib, pickle
 import xml.etree.ElementTree as ET
 
 import setzer.helpers.path as path_helpers
+from setzer.helpers.bibtex_scanner import BibTeXScanner
+from setzer.helpers.prefix_index import PrefixIndex
 from setzer.app.service_locator import ServiceLocator
 
 
 class LaTeXDB():
 
-    static_proposals = dict()
+    static_proposals = None
+    static_proposals_version = 1
+    command_files = ['additional.xml', 'latex-document.xml', 'dynamic.xml', 'tex.xml', 'textcomp.xml', 'graphicx.xml', 'latex-dev.xml', 'amsmath.xml', 'amsopn.xml', 'amsbsy.xml', 'amsfonts.xml', 'amssymb.xml', 'amsthm.xml', 'color.xml', 'url.xml', 'geometry.xml', 'glossaries.xml', 'beamer.xml', 'hyperref.xml']
+    dynamic_proposals = {'labels': PrefixIndex(), 'bibitems': PrefixIndex()}
+    max_static_proposals = 20
+    max_dynamic_proposals = 100
     resources_path = None
     dynamic_commands = dict()
     dynamic_commands['references'] = ['\\ref*', '\\ref', '\\pageref*', '\\pageref', '\\eqref']
     dynamic_commands['citations'] = ['\\citet*', '\\citet', '\\citep*', '\\citep', '\\citealt', '\\citealp', '\\citeauthor*', '\\citeauthor', '\\citeyearpar', '\\citeyear', '\\textcite', '\\parencite', '\\autocite', '\\cite']
+    workspace = None
     files = dict()
+    file_monitors = dict()
+    file_cache = None
+    file_cache_changed = False
+    file_cache_version = 1
     languages_dict = None
     packages_dict = None
 
-    def init(resources_path):
+    def init(resources_path, workspace):
         LaTeXDB.resources_path = resources_path
-        LaTeXDB.generate_static_proposals()
-        LaTeXDB.parse_included_files()
-        GObject.timeout_add(3000, LaTeXDB.parse_included_files)
+        LaTeXDB.workspace = workspace
+
+        workspace.connect('new_document', LaTeXDB.on_new_document)
+        workspace.connect('document_removed', LaTeXDB.on_document_removed)
 
     def get_items(word, top_item=None):
-        try: static_items = LaTeXDB.static_proposals[word.lower()]
-        except KeyError: static_items = list()
+        static_items = list()
+        if len(word) >= 2:
+            static_items = LaTeXDB.get_static_proposals().get_items(word, LaTeXDB.max_static_proposals)
         dynamic_items = LaTeXDB.get_dynamic_proposals(word.lower())
         if len(static_items) > 0 and len(dynamic_items) > 4:
             items = dynamic_items[:5] + static_items + dynamic_items[5:]
@@ -61,32 +75,66 @@ class LaTeXDB():
                 result.append(item)
         return result
 
+    def get_static_proposals():
+        ''' Loads the command index on the first autocomplete request.
+            The index is compiled from the xml files once and kept in
+            the config folder until one of them changes. '''
+
+        if LaTeXDB.static_proposals != None: return LaTeXDB.static_proposals
+
+        folder = os.path.join(LaTeXDB.resources_path, 'latexdb', 'commands')
+        files_info = list()
+        for filename in LaTeXDB.command_files:
+            stat = os.stat(os.path.join(folder, filename))
+            files_info.append((filename, stat.st_mtime, stat.st_size))
+        cache_key = (LaTeXDB.static_proposals_version, folder, files_info)
+
+        pathname = os.path.join(ServiceLocator.get_config_folder(), 'latexdb_commands.pickle')
+        try: filehandle = open(pathname, 'rb')
+        except IOError: pass
+        else:
+            try: data = pickle.load(filehandle)
+            except Exception: data = None
+            filehandle.close()
+            if data != None and data['key'] == cache_key:
+                LaTeXDB.static_proposals = data['static_proposals']
+                return LaTeXDB.static_proposals
+
+        LaTeXDB.static_proposals = LaTeXDB.generate_static_proposals()
+        LaTeXDB.write_cache(pathname, {'key': cache_key, 'static_proposals': LaTeXDB.static_proposals})
+        return LaTeXDB.static_proposals
+
+    def write_cache(pathname, data):
+        ''' Caches are best effort, when writing fails (disk full, read only
+            config folder) they are just built again next time. '''
+
+        try:
+            with open(pathname + '.tmp', 'wb') as filehandle:
+                pickle.dump(data, filehandle)
+            os.replace(pathname + '.tmp', pathname)
+        except OSError:
+            try: os.remove(pathname + '.tmp')
+            except OSError: pass
+            return False
+        return True
+
     def generate_static_proposals():
-        commands = LaTeXDB.get_commands()
-        LaTeXDB.static_proposals = dict()
-        for command in commands.values():
-            if not command['lowpriority']:
-                for i in range(2, len(command['command']) + 1):
-                    if not command['command'][0:i].lower() in LaTeXDB.static_proposals:
-                        LaTeXDB.static_proposals[command['command'][0:i].lower()] = []
-                    if len(LaTeXDB.static_proposals[command['command'][0:i].lower()]) < 20:
-                        LaTeXDB.static_proposals[command['command'][0:i].lower()].append(command)
-        for command in commands.values():
-            if command['lowpriority']:
-                for i in range(2, len(command['command']) + 1):
-                    if not command['command'][0:i].lower() in LaTeXDB.static_proposals:
-                        LaTeXDB.static_proposals[command['command'][0:i].lower()] = []
-                    if len(LaTeXDB.static_proposals[command['command'][0:i].lower()]) < 20:
-                        LaTeXDB.static_proposals[command['command'][0:i].lower()].append(command)
+        static_proposals = PrefixIndex(ranked=True)
+        for position, command in enumerate(LaTeXDB.get_commands().values()):
+            static_proposals.add(command['command'], command, (command['lowpriority'], position))
+        return static_proposals
 
     def get_commands():
+        ''' Descriptions are gettext msgids, they are translated with
+            _() where they are shown. '''
+
         commands = dict()
-        for filename in ['additional.xml', 'latex-document.xml', 'dynamic.xml', 'tex.xml', 'textcomp.xml', 'graphicx.xml', 'latex-dev.xml', 'amsmath.xml', 'amsopn.xml', 'amsbsy.xml', 'amsfonts.xml', 'amssymb.xml', 'amsthm.xml', 'color.xml', 'url.xml', 'geometry.xml', 'glossaries.xml', 'beamer.xml', 'hyperref.xml']:
+        for filename in LaTeXDB.command_files:
             tree = ET.parse(os.path.join(LaTeXDB.resources_path, 'latexdb', 'commands', filename))
             root = tree.getroot()
             for child in root:
                 attrib = child.attrib
-                commands[attrib['name']] = {'command': attrib['text'], 'description': _(attrib['description']), 'lowpriority': True if attrib['lowpriority'] == "True" else False, 'dotlabels': attrib['dotlabels']}
+                commands[attrib['name']] = {'command': attrib['text'], 'description': attrib['description'], 'lowpriority': True if attrib['lowpriority'] == "True" else False, 'dotlabels': attrib['dotlabels']}
         return commands
 
     def get_dynamic_proposals(word):
@@ -100,52 +148,155 @@ class LaTeXDB():
         key = 'labels' if matchings['labels'] != None else 'bibitems'
         if matchings['labels'] == None and matchings['bibitems'] == None: return list()
 
+        command_name = matchings[key].group(1)
+        argument = word[len(command_name):]
+        if argument.endswith('}'):
+            argument = argument[:-1]
+        if not (argument == '' or argument.startswith('{')): return list()
+
         commands = list()
-        for file in LaTeXDB.files.values():
-            for value in file[key]:
-                command = matchings[key].group(1) + '{' + value + '}'
-                if command.startswith(word):
-                    commands.append({'command': command, 'description': '', 'lowpriority': False, 'dotlabels': ''})
+        for value in LaTeXDB.dynamic_proposals[key].get_items(argument[1:], LaTeXDB.max_dynamic_proposals):
+            commands.append({'command': command_name + '{' + value + '}', 'description': '', 'lowpriority': False, 'dotlabels': ''})
         return commands
 
-    def parse_included_files():
-        workspace = ServiceLocator.get_workspace()
-        if workspace == None: return
+    def on_new_document(workspace, document):
+        document.connect('filename_change', LaTeXDB.on_filename_change)
+        document.parser.connect('finished_parsing', LaTeXDB.on_parser_update)
+        LaTeXDB.update_files()
+
+    def on_document_removed(workspace, document):
+        document.disconnect('filename_change', LaTeXDB.on_filename_change)
+        document.parser.disconnect('finished_parsing', LaTeXDB.on_parser_update)
+        LaTeXDB.update_files()
+
+    def on_filename_change(document, filename=None):
+        LaTeXDB.update_files()
+
+    def on_parser_update(parser):
+        filename = parser.document.get_filename()
+        if filename == None: return
+
+        # most edits don't change includes or bibliographies.
+        if filename in LaTeXDB.files and LaTeXDB.files[filename]['includes'] == LaTeXDB.get_includes(parser.document):
+            return
+        LaTeXDB.update_files()
+
+    def get_includes(document):
+        includes = list()
+        dirname = document.get_dirname()
+        for filename, offset in document.parser.symbols['included_latex_files']:
+            includes.append(path_helpers.get_abspath(filename, dirname))
+        for filename in document.parser.symbols['bibliographies']:
+            includes.append(path_helpers.get_abspath(filename, dirname))
+        return includes
+
+    def update_files():
+        ''' Rebuilds the dict of files (open documents and the files
+            they include) and watches them for changes. Only files
+            not seen before are read here, the others are updated
+            by their file monitors. '''
 
         def get_file_dict(filename):
             if filename in LaTeXDB.files:
                 return LaTeXDB.files[filename]
             else:
-                return {'last_parse': -1, 'bibitems': list(), 'labels': list(), 'includes': list()}
+                return {'last_parse': -1, 'bibitems': set(), 'labels': set(), 'includes': list()}
 
         files = dict()
-        for document in ServiceLocator.get_workspace().open_documents:
+        for document in LaTeXDB.workspace.open_documents:
             if document.get_filename() != None:
                 files[document.get_filename()] = get_file_dict(document.get_filename())
-                files[document.get_filename()]['includes'] = list()
-
-                dirname = document.get_dirname()
-                for filename, offset in document.parser.symbols['included_latex_files']:
-                    filename = path_helpers.get_abspath(filename, dirname)
-                    files[document.get_filename()]['includes'].append(filename)
-                    files[filename] = get_file_dict(filename)
-                for filename in document.parser.symbols['bibliographies']:
-                    filename = path_helpers.get_abspath(filename, dirname)
-                    files[document.get_filename()]['includes'].append(filename)
+                files[document.get_filename()]['includes'] = LaTeXDB.get_includes(document)
+                for filename in files[document.get_filename()]['includes']:
                     files[filename] = get_file_dict(filename)
+        for filename, file_dict in LaTeXDB.files.items():
+            if filename not in files:
+                LaTeXDB.update_dynamic_proposals(file_dict['labels'], file_dict['bibitems'], set(), set())
         LaTeXDB.files = files
 
-        for filename, file_dict in LaTeXDB.files.items():
-            if os.path.isfile(filename):
-                last_modified = os.path.getmtime(filename)
-                if file_dict['last_parse'] < last_modified:
-                    if filename.endswith('.tex'):
-                        LaTeXDB.parse_latex_file(filename)
-                    elif filename.endswith('.bib'):
-                        LaTeXDB.parse_bibtex_file(filename)
-                    LaTeXDB.files[filename]['last_parse'] = time.time()
+        for filename in list(LaTeXDB.file_monitors):
+            if filename not in LaTeXDB.files:
+                LaTeXDB.file_monitors[filename].cancel()
+                del(LaTeXDB.file_monitors[filename])
 
-        return True
+        for filename, file_dict in LaTeXDB.files.items():
+            if filename not in LaTeXDB.file_monitors:
+                LaTeXDB.add_file_monitor(filename)
+            if file_dict['last_parse'] == -1 and os.path.isfile(filename):
+                LaTeXDB.update_file(filename)
+                file_dict['last_parse'] = time.time()
+        LaTeXDB.save_file_cache()
+
+    def add_file_monitor(filename):
+        try: monitor = Gio.File.new_for_path(filename).monitor_file(Gio.FileMonitorFlags.NONE, None)
+        except GLib.Error: return
+        monitor.connect('changed', LaTeXDB.on_file_changed, filename)
+        LaTeXDB.file_monitors[filename] = monitor
+
+    def on_file_changed(monitor, file, other_file, event_type, filename):
+        if event_type not in [Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.CREATED]: return
+        if filename not in LaTeXDB.files: return
+        if not os.path.isfile(filename): return
+
+        LaTeXDB.update_file(filename)
+        LaTeXDB.files[filename]['last_parse'] = time.time()
+        LaTeXDB.save_file_cache()
+
+    def update_file(pathname):
+        ''' Gets labels and bibitems of a file from the file cache,
+            parsing it only if its content is unknown. '''
+
+        if not (pathname.endswith('.tex') or pathname.endswith('.bib')): return
+
+        file_cache = LaTeXDB.get_file_cache()
+        stat = os.stat(pathname)
+        try: entry = file_cache[pathname]
+        except KeyError: entry = None
+
+        if entry == None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+            with open(pathname, 'rb') as f:
+                content_hash = hashlib.sha1(f.read()).hexdigest()
+            if entry == None or entry['hash'] != content_hash:
+                if pathname.endswith('.tex'):
+                    labels, bibitems = LaTeXDB.parse_latex_file(pathname)
+                else:
+                    labels, bibitems = LaTeXDB.parse_bibtex_file(pathname)
+                entry = {'hash': content_hash, 'labels': labels, 'bibitems': bibitems}
+            entry['mtime'] = stat.st_mtime
+            entry['size'] = stat.st_size
+            file_cache[pathname] = entry
+            LaTeXDB.file_cache_changed = True
+
+        file_dict = LaTeXDB.files[pathname]
+        LaTeXDB.update_dynamic_proposals(file_dict['labels'], file_dict['bibitems'], entry['labels'], entry['bibitems'])
+        file_dict['labels'] = entry['labels']
+        file_dict['bibitems'] = entry['bibitems']
+
+    def update_dynamic_proposals(old_labels, old_bibitems, labels, bibitems):
+        LaTeXDB.dynamic_proposals['labels'].update(old_labels - labels, labels - old_labels)
+        LaTeXDB.dynamic_proposals['bibitems'].update(old_bibitems - bibitems, bibitems - old_bibitems)
+
+    def get_file_cache():
+        if LaTeXDB.file_cache == None:
+            LaTeXDB.file_cache = dict()
+            try: filehandle = open(os.path.join(ServiceLocator.get_config_folder(), 'latexdb_files.pickle'), 'rb')
+            except IOError: pass
+            else:
+                try: data = pickle.load(filehandle)
+                except Exception: data = None
+                filehandle.close()
+                if data != None and data['version'] == LaTeXDB.file_cache_version:
+                    for pathname, entry in data['files'].items():
+                        if os.path.isfile(pathname):
+                            LaTeXDB.file_cache[pathname] = entry
+        return LaTeXDB.file_cache
+
+    def save_file_cache():
+        if not LaTeXDB.file_cache_changed: return
+
+        pathname = os.path.join(ServiceLocator.get_config_folder(), 'latexdb_files.pickle')
+        if LaTeXDB.write_cache(pathname, {'version': LaTeXDB.file_cache_version, 'files': LaTeXDB.file_cache}):
+            LaTeXDB.file_cache_changed = False
 
     def parse_latex_file(pathname):
         with open(pathname, 'r') as f:
@@ -159,17 +310,15 @@ class LaTeXDB():
             elif match.group(5) == 'bibitem':
                 bibitems = bibitems | {match.group(6).strip()}
 
-        LaTeXDB.files[pathname]['bibitems'] = bibitems
-        LaTeXDB.files[pathname]['labels'] = labels
+        return (labels, bibitems)
 
     def parse_bibtex_file(pathname):
-        with open(pathname, 'r') as f:
-            db = bibtexparser.load(f)
         bibitems = set()
-        for match in db.entries:
-            bibitems = bibitems | {match['ID']}
+        with open(pathname, 'r', errors='replace') as f:
+            for entry in BibTeXScanner().scan_file(f):
+                bibitems.add(entry['key'])
 
-        LaTeXDB.files[pathname]['bibitems'] = bibitems
+        return (set(), bibitems)
 
     def get_languages_dict():
         if LaTeXDB.languages_dict == None:
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+
+import gi
+gi.require_version('Gtk', '4.0')
+from gi.repository import Gtk, Gio
+
+import os.path
+
+
+class ExportBuildProfilesDialog(object):
+
+    def __init__(self, main_window):
+        self.main_window = main_window
+        self.document = None
+
+    def run(self, document):
+        self.document = document
+        self.setup()
+        self.view.save(self.main_window, None, self.dialog_process_response)
+
+    def setup(self):
+        self.view = Gtk.FileDialog()
+        self.view.set_modal(True)
+        self.view.set_title(_('Export build timings'))
+
+        pathname = self.document.get_filename()
+        if pathname != None:
+            self.view.set_initial_name(os.path.splitext(os.path.basename(pathname))[0] + '-build-timings.json')
+            self.view.set_initial_folder(Gio.File.new_for_path(self.document.get_dirname()))
+        else:
+            self.view.set_initial_name('build-timings.json')
+
+    def dialog_process_response(self, dialog, result):
+        try:
+            file = dialog.save_finish(result)
+        except Exception: pass
+        else:
+            if file != None:
+                try:
+                    with open(file.get_path(), 'w') as f:
+                        f.write(self.document.build_system.get_build_profiles_json())
+                except (OSError, TypeError) as e:
+                    self.show_error(file.get_parse_name(), e)
+
+    def show_error(self, filename, error):
+        # TypeError: not a local file, get_path() returns None.
+        detail = error.strerror if isinstance(error, OSError) and error.strerror != None else _('Only local files can be written.')
+        alert = Gtk.AlertDialog()
+        alert.set_modal(True)
+        alert.set_message(_('The build timings could not be exported.'))
+        alert.set_detail(_('Writing "{filename}" failed: {reason}').format(filename=filename, reason=detail))
+        alert.set_buttons([_('_Close')])
+        alert.show(self.main_window)
+
+
@@ -36,6 +36,12 @@ class PageBuildSystem(object):
         self.view.option_cleanup_build_files.set_active(self.settings.get_value('preferences', 'cleanup_build_files'))
         self.view.option_cleanup_build_files.connect('toggled', self.preferences.on_check_button_toggle, 'cleanup_build_files')
 
+        self.view.option_use_precompiled_preamble.set_active(self.settings.get_value('preferences', 'use_precompiled_preamble'))
+        self.view.option_use_precompiled_preamble.connect('toggled', self.preferences.on_check_button_toggle, 'use_precompiled_preamble')
+
+        self.view.option_live_preview.set_active(self.settings.get_value('preferences', 'live_preview'))
+        self.view.option_live_preview.connect('toggled', self.preferences.on_check_button_toggle, 'live_preview')
+
         self.view.option_autoshow_build_log_errors.set_active(self.settings.get_value('preferences', 'autoshow_build_log') == 'errors')
         self.view.option_autoshow_build_log_errors_warnings.set_active(self.settings.get_value('preferences', 'autoshow_build_log') == 'errors_warnings')
         self.view.option_autoshow_build_log_all.set_active(self.settings.get_value('preferences', 'autoshow_build_log') == 'all')
@@ -188,6 +194,12 @@ flatpak install org.freedesktop.Sdk.Extension.texlive'''))
         self.option_use_latexmk = Gtk.CheckButton.new_with_label(_('Use Latexmk'))
         self.append(self.option_use_latexmk)
 
+        self.option_use_precompiled_preamble = Gtk.CheckButton.new_with_label(_('Precompile the preamble for faster builds (PdfLaTeX only).'))
+        self.append(self.option_use_precompiled_preamble)
+
+        self.option_live_preview = Gtk.CheckButton.new_with_label(_('Update the preview while typing, without saving (live preview).'))
+        self.append(self.option_live_preview)
+
         label = Gtk.Label()
         label.set_markup('<b>' + _('Automatically show build log ..') + ' </b>')
         label.set_xalign(0)
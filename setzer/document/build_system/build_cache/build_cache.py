@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+
+import _thread as thread
+import hashlib
+import os
+import os.path
+
+from setzer.app.service_locator import ServiceLocator
+
+class BuildCache():
+    ''' Remembers the inputs of the last successful build of each
+        document, as recorded by the interpreter in its .fls file
+        (-recorder), together with the build options and the result.
+
+        A build with the same options and inputs would produce the same
+        pdf, so the old result can be reused. Files next to the document
+        are compared by a hash of their content, files of the TeX
+        distribution by modification time and size. Intermediate files
+        of the build itself (.aux, .toc, .bbl, ...) are left out, they
+        follow from the other inputs. '''
+
+    def __init__(self):
+        self.entries = dict()
+        self.lock = thread.allocate_lock()
+
+        self.intermediate_endings = ['.aux', '.blg', '.bbl', '.dvi', '.xdv', '.fdb_latexmk', '.fls', '.idx' , '.ilg',
+                                     '.ind', '.log', '.nav', '.out', '.snm', '.synctex.gz', '.toc',
+                                     '.ist', '.glo', '.glg', '.acn', '.alg', '.gls', '.acr',
+                                     '.bcf', '.run.xml', '.out.ps', '.pdf']
+        self.bib_file_regexes = [ServiceLocator.get_regex_object(r'Database file #[0-9]+: (.*)'),
+                                 ServiceLocator.get_regex_object(r'Found BibTeX data source \'(.*)\'')]
+
+    def get_build_result(self, query, synctex_filename):
+        ''' Returns a copy of the stored build result if nothing the
+            build depends on has changed since, None otherwise. '''
+
+        with self.lock:
+            try:
+                entry = self.entries[query.tex_filename]
+            except KeyError:
+                return None
+
+            if entry['options'] != self.get_options(query): return None
+            if self.get_stat(entry['build_result']['pdf_filename']) != entry['pdf_stat']: return None
+            if entry['build_result']['has_synctex_file'] and not os.path.isfile(synctex_filename): return None
+
+            for filename, file_state in entry['files'].items():
+                if not self.is_unchanged(filename, file_state): return None
+                file_state['stat'] = self.get_stat(filename)
+
+            build_result = dict(entry['build_result'])
+            build_result['cached'] = True
+            return build_result
+
+    def add_build_result(self, query, build_result):
+        ''' Reads the recorded inputs, has to run before the build files
+            are cleaned up. '''
+
+        basename = query.get_output_filename('')
+        filenames = self.get_recorded_inputs(basename + '.fls')
+        with self.lock:
+            if filenames == None:
+                self.entries.pop(query.tex_filename, None)
+                return
+
+            filenames |= self.get_bib_files(query, basename + '.blg')
+            filenames -= {basename + ending for ending in self.intermediate_endings}
+            filenames.discard(query.build_data.get('include_only_wrapper', None))
+
+            dirname = os.path.dirname(query.tex_filename)
+            files = dict()
+            for filename in filenames:
+                if filename.startswith(ServiceLocator.get_config_folder() + os.sep): continue
+                files[filename] = self.get_file_state(filename, filename.startswith(dirname + os.sep))
+
+            self.entries[query.tex_filename] = {'options': self.get_options(query),
+                                                'files': files,
+                                                'pdf_stat': self.get_stat(build_result['pdf_filename']),
+                                                'build_result': build_result}
+
+    def remove_build_result(self, tex_filename):
+        with self.lock:
+            self.entries.pop(tex_filename, None)
+
+    def get_options(self, query):
+        return (query.build_data['latex_interpreter'], query.build_data['use_latexmk'], query.build_data['additional_arguments'], query.build_data.get('include_only', None))
+
+    def get_recorded_inputs(self, fls_filename):
+        ''' Returns the files the interpreter read and didn't write
+            itself, None if there is no recorder file. '''
+
+        try:
+            with open(fls_filename, 'r', errors='replace') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return None
+
+        inputs, outputs = set(), set()
+        working_directory = os.path.dirname(fls_filename)
+        for line in lines:
+            kind, separator, filename = line.partition(' ')
+            if kind == 'PWD':
+                working_directory = filename
+            elif kind == 'INPUT':
+                inputs.add(os.path.normpath(os.path.join(working_directory, filename)))
+            elif kind == 'OUTPUT':
+                outputs.add(os.path.normpath(os.path.join(working_directory, filename)))
+        return inputs - outputs
+
+    def get_bib_files(self, query, blg_filename):
+        ''' BibTeX and biber don't show up in the recorder file, their
+            databases are taken from the log they leave. '''
+
+        try:
+            with open(blg_filename, 'r', errors='replace') as f:
+                text = f.read()
+        except OSError:
+            return set()
+
+        filenames = set()
+        for regex in self.bib_file_regexes:
+            for match in regex.finditer(text):
+                filenames.add(os.path.normpath(os.path.join(os.path.dirname(query.tex_filename), match.group(1).strip())))
+        return filenames
+
+    def get_file_state(self, filename, hash_content):
+        file_state = {'stat': self.get_stat(filename), 'content_hash': None}
+        if hash_content and file_state['stat'] != None:
+            file_state['content_hash'] = self.get_content_hash(filename)
+        return file_state
+
+    def is_unchanged(self, filename, file_state):
+        stat = self.get_stat(filename)
+        if stat == file_state['stat']: return True
+        if stat == None or file_state['content_hash'] == None: return False
+        return self.get_content_hash(filename) == file_state['content_hash']
+
+    def get_content_hash(self, filename):
+        sha1 = hashlib.sha1()
+        try:
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    sha1.update(chunk)
+        except OSError:
+            return None
+        return sha1.hexdigest()
+
+    def get_stat(self, filename):
+        if filename == None: return None
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+
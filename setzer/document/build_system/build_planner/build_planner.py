@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+
+import _thread as thread
+import hashlib
+import os.path
+
+from setzer.app.service_locator import ServiceLocator
+
+
+class BuildPlanner():
+    ''' Decides what runs after a LaTeX pass, going by the files the
+        pass has left behind.
+
+        BibTeX, biber, makeindex and makeglossaries each read one kind of
+        file (the citations in the .aux, the .bcf, the .idx, the .glo and
+        .acn). A tool is due if its output is missing or its input has
+        changed since it last ran. All tools that are due run side by
+        side, followed by one more LaTeX pass. Without tools due, LaTeX
+        runs again until the .aux (and .toc, .out, ...) files stay the
+        same between passes.
+
+        Passes that are sure to be followed by another one (the first
+        one without .aux file, the ones after tools have run) are draft
+        passes, they don't write the pdf. If a draft pass turns out to
+        be the last one, a pass writing the pdf is added. '''
+
+    def __init__(self):
+        self.tool_input_hashes = dict()
+        self.lock = thread.allocate_lock()
+        self.max_latex_passes = 5
+        self.draft_mode_interpreters = ['pdflatex', 'xelatex', 'lualatex']
+
+        self.aux_endings = ['.toc', '.lof', '.lot', '.out', '.nav', '.snm']
+        self.aux_input_regex = ServiceLocator.get_regex_object(r'\\@input\{([^\}]*)\}')
+        self.bibtex_input_regex = ServiceLocator.get_regex_object(r'(?m)^\\(?:citation|bibdata|bibstyle)\{.*$')
+
+    def get_next_jobs(self, query, log_items, aux_state):
+        ''' Returns the jobs to put in front of the query, a tuple stands
+            for jobs that can run at the same time. aux_state is the
+            state of the .aux files before the pass. '''
+
+        was_draft_pass = query.build_data['draft_pass']
+        query.build_data['draft_pass'] = False
+
+        # latexmk and tectonic run the tools and passes they need themselves.
+        if query.build_data['use_latexmk'] or query.build_data['latex_interpreter'] == 'tectonic': return []
+
+        if query.build_data['latex_passes'] >= self.max_latex_passes:
+            return ['build_latex'] if was_draft_pass else []
+
+        tools = list()
+        for job, input_hash, output_missing, rerun_requested in self.get_tool_inputs(query, log_items):
+            with self.lock:
+                last_hash = self.tool_input_hashes.get((query.tex_filename, job), None)
+                if (output_missing or rerun_requested) and not self.has_run(query, job):
+                    tools.append(job)
+                elif last_hash != None and last_hash != input_hash:
+                    tools.append(job)
+                self.tool_input_hashes[(query.tex_filename, job)] = input_hash
+
+        if len(tools) > 0:
+            query.build_data['draft_pass'] = self.can_use_draft_mode(query)
+            return [tuple(tools), 'build_latex']
+        if self.get_aux_state(query) != aux_state or was_draft_pass:
+            return ['build_latex']
+        return []
+
+    def plan_first_pass(self, query):
+        ''' Without .aux file the first pass writes one, so there will
+            be a second pass. '''
+
+        query.build_data['draft_pass'] = self.can_use_draft_mode(query) and not os.path.isfile(query.get_output_filename('.aux'))
+
+    def can_use_draft_mode(self, query):
+        # latexmk decides about passes itself.
+        return query.build_data['latex_interpreter'] in self.draft_mode_interpreters and not query.build_data['use_latexmk']
+
+    def get_tool_inputs(self, query, log_items):
+        ''' Yields (job, input hash, output missing, rerun requested) for
+            each tool the document uses. '''
+
+        basename = query.get_output_filename('')
+        name = os.path.basename(basename)
+
+        lines = list()
+        for text in self.get_aux_texts(query):
+            lines += [match.group(0) for match in self.bibtex_input_regex.finditer(text)]
+        if any(line.startswith('\\bibdata') for line in lines):
+            yield ('build_bibtex', self.get_hash('\n'.join(lines).encode('utf-8')), not os.path.isfile(basename + '.bbl'), False)
+
+        if os.path.isfile(basename + '.bcf'):
+            rerun_requested = False
+            for items in log_items.values():
+                for item in items['warning']:
+                    if item[2] == 'Please (re)run Biber on the file:' and len(item) > 3 and item[3].find(name) >= 0:
+                        rerun_requested = True
+            yield ('build_biber', self.get_file_hash([basename + '.bcf']), not os.path.isfile(basename + '.bbl'), rerun_requested)
+
+        if os.path.isfile(basename + '.idx'):
+            yield ('build_makeindex', self.get_file_hash([basename + '.idx']), not os.path.isfile(basename + '.ind'), False)
+
+        if os.path.isfile(basename + '.glo') or os.path.isfile(basename + '.acn'):
+            output_missing = (os.path.isfile(basename + '.glo') and not os.path.isfile(basename + '.gls')) or (os.path.isfile(basename + '.acn') and not os.path.isfile(basename + '.acr'))
+            yield ('build_glossaries', self.get_file_hash([basename + '.glo', basename + '.acn', basename + '.ist']), output_missing, False)
+
+    def has_run(self, query, job):
+        name = os.path.basename(os.path.splitext(query.tex_filename)[0])
+        if job == 'build_bibtex': return name in query.bibtex_data['ran_on_files']
+        if job == 'build_biber': return name in query.biber_data['ran_on_files']
+        if job == 'build_makeindex': return name in query.makeindex_data['ran_on_files']
+        if job == 'build_glossaries': return name in query.glossaries_data['ran_on_files']
+        return False
+
+    def get_aux_state(self, query):
+        ''' Hash of everything LaTeX reads back from the previous pass. '''
+
+        basename = query.get_output_filename('')
+        aux_hash = self.get_hash('\0'.join(self.get_aux_texts(query)).encode('utf-8'))
+        return (aux_hash, self.get_file_hash([basename + ending for ending in self.aux_endings]))
+
+    def get_aux_texts(self, query):
+        ''' The main .aux file and the ones it includes (\\include). '''
+
+        dirname = query.get_output_directory()
+        filenames = [query.get_output_filename('.aux')]
+        texts = list()
+        while len(filenames) > 0 and len(texts) < 1000:
+            filename = filenames.pop(0)
+            try:
+                with open(filename, 'r', errors='replace') as f:
+                    text = f.read()
+            except OSError:
+                texts.append('')
+                continue
+            texts.append(text)
+            for match in self.aux_input_regex.finditer(text):
+                filenames.append(os.path.join(dirname, match.group(1)))
+        return texts
+
+    def get_file_hash(self, filenames):
+        sha1 = hashlib.sha1()
+        for filename in filenames:
+            try:
+                with open(filename, 'rb') as f:
+                    sha1.update(f.read())
+            except OSError:
+                sha1.update(b'\0missing')
+            sha1.update(b'\0')
+        return sha1.hexdigest()
+
+    def get_hash(self, data):
+        return hashlib.sha1(data).hexdigest()
+
+
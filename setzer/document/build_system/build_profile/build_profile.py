@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+
+import _thread as thread
+import contextlib
+import time
+
+
+class BuildProfile():
+    ''' Timings of the stages of one build. Each span has its wall time,
+        the cpu time of the thread running it and the cpu time and peak
+        memory of the processes it waited for (latex, biber, ...).
+
+        Child usage is added by the builders for each process they reap,
+        the usage of all children of the app would count other builds
+        (live previews, other documents) too. '''
+
+    def __init__(self, tex_filename, mode):
+        self.tex_filename = tex_filename
+        self.mode = mode
+        self.start_time = time.time()
+        self.start_counter = time.perf_counter()
+        self.spans = list()
+        self.open_spans = dict()
+        self.parents = dict()
+        self.lock = thread.allocate_lock()
+
+    @contextlib.contextmanager
+    def span(self, name, parent=None):
+        ''' Measures the code inside the with block. Spans opened inside
+            are nested, parent is for spans in another thread. '''
+
+        with self.lock:
+            stack = self.open_spans.setdefault(thread.get_ident(), list())
+            if parent == None and len(stack) > 0:
+                parent = stack[-1]
+            span = {'name': name,
+                    'depth': parent['depth'] + 1 if parent != None else 0,
+                    'start': time.perf_counter() - self.start_counter,
+                    'wall_time': None,
+                    'cpu_time': None,
+                    'child_cpu_time': None,
+                    'max_child_rss': None}
+            self.spans.append(span)
+            self.parents[id(span)] = parent
+            stack.append(span)
+
+        thread_time = time.thread_time()
+        try:
+            yield span
+        finally:
+            span['wall_time'] = time.perf_counter() - self.start_counter - span['start']
+            span['cpu_time'] = time.thread_time() - thread_time
+            with self.lock:
+                stack.remove(span)
+
+    def add_child_usage(self, usage):
+        ''' Adds the resource usage of a reaped child (from os.wait4) to
+            the innermost open span of this thread and the spans around it. '''
+
+        if usage == None: return
+
+        cpu_time = usage.ru_utime + usage.ru_stime
+        max_rss = usage.ru_maxrss * 1024
+        with self.lock:
+            stack = self.open_spans.get(thread.get_ident(), list())
+            span = stack[-1] if len(stack) > 0 else None
+            while span != None:
+                span['child_cpu_time'] = cpu_time if span['child_cpu_time'] == None else span['child_cpu_time'] + cpu_time
+                if span['max_child_rss'] == None or max_rss > span['max_child_rss']:
+                    span['max_child_rss'] = max_rss
+                span = self.parents[id(span)]
+
+    def get_data(self, build_result):
+        ''' Returns the profile as a dict, for the history and export. '''
+
+        with self.lock:
+            spans = [dict(span) for span in self.spans]
+
+        return {'filename': self.tex_filename,
+                'mode': self.mode,
+                'start_time': self.start_time,
+                'wall_time': time.perf_counter() - self.start_counter,
+                'cached': build_result.get('cached', False),
+                'error': build_result.get('error', None),
+                'spans': spans}
+
+
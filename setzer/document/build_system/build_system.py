@@ -16,14 +16,17 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
 import gi
-from gi.repository import GObject
+from gi.repository import GObject, GLib
 
 import _thread as thread, queue
-import time, re, difflib
+import time, re, difflib, json
+import os.path, base64
 
 from setzer.app.service_locator import ServiceLocator
 from setzer.dialogs.dialog_locator import DialogLocator
+import setzer.document.build_system.builder.builder_check_build_cache as builder_check_build_cache
 import setzer.document.build_system.builder.builder_build_latex as builder_build_latex
+import setzer.document.build_system.builder.builder_build_preamble as builder_build_preamble
 import setzer.document.build_system.builder.builder_build_bibtex as builder_build_bibtex
 import setzer.document.build_system.builder.builder_build_biber as builder_build_biber
 import setzer.document.build_system.builder.builder_build_makeindex as builder_build_makeindex
@@ -31,7 +34,13 @@ import setzer.document.build_system.builder.builder_build_glossaries as builder_
 import setzer.document.build_system.builder.builder_forward_sync as builder_forward_sync
 import setzer.document.build_system.builder.builder_backward_sync as builder_backward_sync
 import setzer.document.build_system.query.query as query
+from setzer.document.build_system.synctex.synctex_index import SyncTeXReader
+from setzer.document.build_system.build_cache.build_cache import BuildCache
+from setzer.document.build_system.build_planner.build_planner import BuildPlanner
+from setzer.document.build_system.build_profile.build_profile import BuildProfile
+from setzer.document.build_system.live_preview.live_preview import LivePreview
 from setzer.helpers.observable import Observable
+import setzer.helpers.path as path_helpers
 
 
 class BuildSystem(Observable):
@@ -46,34 +55,43 @@ class BuildSystem(Observable):
         # building_in_progress, building_to_stop
         self.build_state = 'idle'
 
-        # possible values: build, forward_sync, build_and_forward_sync
+        # possible values: build, forward_sync, build_and_forward_sync, live_build
         self.build_mode = 'build_and_forward_sync'
 
         self.document_has_been_built = False
         self.build_time = None
+        self.build_was_cached = False
         self.last_build_start_time = None
+        self.build_cache = BuildCache()
+        self.build_planner = BuildPlanner()
+        self.build_profiles = list()
+        self.max_build_profiles = 20
+        self.live_preview = LivePreview(self)
 
         self.has_synctex_file = False
         self.backward_sync_data = None
         self.forward_sync_arguments = None
+        self.include_only_name = None
+        self.include_regex = ServiceLocator.get_regex_object(r'\\include\{([^\}]*)\}')
         self.can_sync = False
+        self.synctex_reader = SyncTeXReader()
         self.update_can_sync()
 
         self.build_log_data = {'items': list(), 'error_count': 0, 'warning_count': 0, 'badbox_count': 0}
 
         self.builders = dict()
-        self.builders['build_latex'] = builder_build_latex.BuilderBuildLaTeX()
+        self.builders['check_build_cache'] = builder_check_build_cache.BuilderCheckBuildCache(self.build_cache)
+        self.builders['build_preamble'] = builder_build_preamble.BuilderBuildPreamble()
+        self.builders['build_latex'] = builder_build_latex.BuilderBuildLaTeX(self.build_cache, self.build_planner)
         self.builders['build_bibtex'] = builder_build_bibtex.BuilderBuildBibTeX()
         self.builders['build_biber'] = builder_build_biber.BuilderBuildBiber()
         self.builders['build_makeindex'] = builder_build_makeindex.BuilderBuildMakeindex()
         self.builders['build_glossaries'] = builder_build_glossaries.BuilderBuildGlossaries()
-        self.builders['forward_sync'] = builder_forward_sync.BuilderForwardSync()
-        self.builders['backward_sync'] = builder_backward_sync.BuilderBackwardSync()
+        self.builders['forward_sync'] = builder_forward_sync.BuilderForwardSync(self.synctex_reader)
+        self.builders['backward_sync'] = builder_backward_sync.BuilderBackwardSync(self.synctex_reader)
 
         self.document.preview.connect('pdf_changed', self.update_can_sync)
 
-        GObject.timeout_add(50, self.results_loop)
-
     def change_build_state(self, state):
         self.build_state = state
 
@@ -129,6 +147,29 @@ class BuildSystem(Observable):
         self.set_build_mode('build_and_forward_sync')
         self.start_building()
 
+    def fast_build_and_forward_sync(self, active_document):
+        ''' Builds only the chapter being edited, with \\includeonly. The
+            other chapters keep what their .aux files say from earlier
+            builds. Builds everything if the chapter isn't \\include'd. '''
+
+        self.include_only_name = self.get_include_only_name(active_document)
+        self.build_and_forward_sync(active_document)
+
+    def get_include_only_name(self, active_document):
+        if active_document == self.document: return None
+        if self.settings.get_value('preferences', 'latex_interpreter') == 'tectonic': return None
+        # symbol offsets are from the last published parse, they may be off.
+        if not self.document.parser.is_up_to_date(): return None
+
+        text = self.document.get_all_text()
+        for filename, offset in self.document.parser.symbols['included_latex_files']:
+            if path_helpers.get_abspath(filename, self.document.get_dirname()) != active_document.get_filename(): continue
+
+            match = self.include_regex.match(text, offset)
+            if match != None:
+                return match.group(1).strip()
+        return None
+
     def set_forward_sync_arguments(self, active_document):
         sb = active_document.source_buffer
         self.forward_sync_arguments = dict()
@@ -174,16 +215,35 @@ class BuildSystem(Observable):
     def get_badbox_count(self):
         return self.build_log_data['badbox_count']
 
-    def results_loop(self):
-        if self.active_query != None:
-            if self.active_query.is_done():
-                build_result = self.active_query.get_build_result()
-                forward_sync_result = self.active_query.get_forward_sync_result()
-                backward_sync_result = self.active_query.get_backward_sync_result()
-                if forward_sync_result != None or backward_sync_result != None or build_result != None:
-                    self.parse_result({'build': build_result, 'forward_sync': forward_sync_result, 'backward_sync': backward_sync_result})
-                self.active_query = None
-        return True
+    def on_query_done(self, query):
+        ''' Called on the main loop when the query thread has finished. '''
+
+        if query != self.active_query: return False
+
+        build_result = query.get_build_result()
+        forward_sync_result = query.get_forward_sync_result()
+        backward_sync_result = query.get_backward_sync_result()
+        if build_result != None:
+            self.add_build_profile(query.build_profile.get_data(build_result))
+        if query.is_live:
+            if build_result != None:
+                self.parse_live_result(build_result)
+        elif forward_sync_result != None or backward_sync_result != None or build_result != None:
+            self.parse_result({'build': build_result, 'forward_sync': forward_sync_result, 'backward_sync': backward_sync_result})
+        self.active_query = None
+        return False
+
+    def parse_live_result(self, build_blob):
+        ''' Live builds only swap the pdf, and only if they succeeded. The
+            build log and synctex data stay with the last regular build. '''
+
+        if build_blob.get('pdf_filename') == None: return
+
+        try:
+            pdf_filename = self.live_preview.keep_pdf(build_blob['pdf_filename'])
+        except OSError: return
+        self.document.preview.set_pdf_filename(pdf_filename)
+        self.document.add_change_code('pdf_updated')
 
     def parse_result(self, result_blob):
         if result_blob['build'] != None or result_blob['forward_sync'] != None:
@@ -215,6 +275,7 @@ class BuildSystem(Observable):
                 build_blob['log_messages']['BibTeX'] = build_blob['bibtex_log_messages']
                 self.set_build_log_items(build_blob['log_messages'])
                 self.build_time = time.time() - self.last_build_start_time
+                self.build_was_cached = build_blob.get('cached', False)
 
                 error_count = self.get_error_count()
                 if error_count > 0:
@@ -223,6 +284,9 @@ class BuildSystem(Observable):
                     self.show_build_state('success')
 
                 self.set_has_synctex_file(build_blob['has_synctex_file'])
+                if build_blob['has_synctex_file']:
+                    synctex_filename = self.builders['backward_sync'].get_synctex_filename(self.document.get_filename())
+                    thread.start_new_thread(self.synctex_reader.get_index, (synctex_filename,))
                 self.document_has_been_built = True
 
         elif result_blob['backward_sync'] != None:
@@ -242,34 +306,94 @@ class BuildSystem(Observable):
         if result_blob['build'] != None:
             self.invalidate_build_log()
 
+    def add_build_profile(self, build_profile):
+        self.build_profiles.append(build_profile)
+        del self.build_profiles[:-self.max_build_profiles]
+
+    def get_build_profiles_json(self):
+        return json.dumps({'document': self.document.get_filename(), 'builds': self.build_profiles}, indent=2)
+
     def add_query(self, query):
+        previous_query = self.active_query
         self.stop_building(notify=False)
         self.active_query = query
-        thread.start_new_thread(self.execute_query, (query,))
+        thread.start_new_thread(self.execute_query, (query, previous_query))
 
-        self.change_build_state('building_in_progress')
+        if not query.is_live:
+            self.change_build_state('building_in_progress')
 
-    def execute_query(self, query):
-        while len(query.jobs) > 0:
-            if not query.force_building_to_stop:
-                self.builders[query.jobs.pop(0)].run(query)
-        query.mark_done()
+    def execute_query(self, query, previous_query=None):
+        # builders are shared, the stopped query has to get out of them first.
+        if previous_query != None:
+            previous_query.wait_until_done()
+
+        try:
+            while len(query.jobs) > 0 and not query.force_building_to_stop:
+                job = query.jobs.pop(0)
+                if isinstance(job, tuple):
+                    self.run_jobs_side_by_side(job, query)
+                else:
+                    with query.build_profile.span(job):
+                        self.builders[job].run(query)
+        finally:
+            query.mark_done()
+        GObject.idle_add(self.on_query_done, query)
+
+    def run_jobs_side_by_side(self, jobs, query):
+        ''' Runs independent jobs (auxiliary tools like biber and
+            makeindex) each in its own thread and waits for all of them. '''
+
+        def run_job(job, lock, parent_span):
+            try:
+                with query.build_profile.span(job, parent=parent_span):
+                    self.builders[job].run(query)
+            finally: lock.release()
+
+        with query.build_profile.span(' + '.join(jobs)) as parent_span:
+            locks = list()
+            for job in jobs:
+                lock = thread.allocate_lock()
+                lock.acquire()
+                thread.start_new_thread(run_job, (job, lock, parent_span))
+                locks.append(lock)
+            for lock in locks:
+                lock.acquire()
+
+    def start_live_build(self):
+        ''' Builds the text in the editor, see LivePreview. Returns False
+            if a regular build is running, those aren't interrupted. '''
+
+        if self.active_query != None and not self.active_query.is_live: return False
+
+        self.set_build_mode('live_build')
+        self.start_building()
+        return True
+
+    def get_build_directory(self):
+        return os.path.join(GLib.get_user_cache_dir(), 'setzer', 'build', base64.urlsafe_b64encode(str.encode(self.document.get_filename())).decode())
 
     def start_building(self):
+        include_only_name = self.include_only_name
+        self.include_only_name = None
+
         if self.build_mode == 'forward_sync' and not self.has_synctex_file: return
         if self.build_mode == 'backward_sync' and self.backward_sync_data == None: return
         if self.document.filename == None: return
 
-        self.build_time = None
         mode = self.get_build_mode()
+        if mode != 'live_build':
+            self.build_time = None
+            self.build_was_cached = False
         query_obj = query.Query(self.document.get_filename()[:])
+        query_obj.build_profile = BuildProfile(query_obj.tex_filename, mode)
 
         if mode in ['forward_sync', 'build_and_forward_sync']:
             synctex_arguments = self.forward_sync_arguments
 
-        if mode in ['build', 'build_and_forward_sync']:
+        if mode in ['build', 'build_and_forward_sync', 'live_build']:
             interpreter = self.settings.get_value('preferences', 'latex_interpreter')
             use_latexmk = self.settings.get_value('preferences', 'use_latexmk')
+            use_precompiled_preamble = self.settings.get_value('preferences', 'use_precompiled_preamble')
             build_option_system_commands = self.settings.get_value('preferences', 'build_option_system_commands')
             additional_arguments = ''
 
@@ -287,13 +411,45 @@ class BuildSystem(Observable):
             text = self.document.get_all_text()
             do_cleanup = self.settings.get_value('preferences', 'cleanup_build_files')
 
+            # tectonic doesn't record its inputs, system commands may read anything.
+            use_build_cache = (interpreter != 'tectonic' and build_option_system_commands != 'enable')
+
+            # the format file would skip an \includeonly in front of the preamble.
+            if include_only_name != None and mode != 'live_build':
+                use_precompiled_preamble = False
+                query_obj.build_data['include_only'] = include_only_name
+                query_obj.build_data['include_only_wrapper'] = os.path.join(self.get_build_directory(), 'includeonly.tex')
+
+            # keeps the document's folder clean without losing the .aux files
+            # (and with them the extra passes) after each build.
+            if do_cleanup and mode != 'live_build':
+                query_obj.build_data['output_directory'] = self.get_build_directory()
+                query_obj.build_data['source_directory'] = self.document.get_dirname()
+
         if mode == 'build':
-            query_obj.jobs = ['build_latex']
+            query_obj.jobs = ['check_build_cache', 'build_preamble', 'build_latex'] if use_precompiled_preamble else ['check_build_cache', 'build_latex']
             query_obj.build_data['text'] = text
             query_obj.build_data['latex_interpreter'] = interpreter
             query_obj.build_data['use_latexmk'] = use_latexmk
             query_obj.build_data['additional_arguments'] = additional_arguments
             query_obj.build_data['do_cleanup'] = do_cleanup
+            query_obj.build_data['use_build_cache'] = use_build_cache
+            query_obj.build_data['format_filename'] = None
+        elif mode == 'live_build':
+            try:
+                query_obj.tex_filename = self.live_preview.write_snapshot()
+            except OSError:
+                return
+            query_obj.is_live = True
+            query_obj.jobs = ['build_preamble', 'build_latex'] if use_precompiled_preamble else ['build_latex']
+            query_obj.build_data['text'] = text
+            query_obj.build_data['latex_interpreter'] = interpreter
+            query_obj.build_data['use_latexmk'] = use_latexmk
+            query_obj.build_data['additional_arguments'] = additional_arguments
+            query_obj.build_data['do_cleanup'] = False
+            query_obj.build_data['use_build_cache'] = False
+            query_obj.build_data['format_filename'] = None
+            query_obj.build_data['source_directory'] = self.document.get_dirname()
         elif mode == 'forward_sync':
             query_obj.jobs = ['forward_sync']
             query_obj.can_sync = True
@@ -309,12 +465,14 @@ class BuildSystem(Observable):
             query_obj.backward_sync_data['word'] = self.backward_sync_data['word']
             query_obj.backward_sync_data['context'] = self.backward_sync_data['context']
         else:
-            query_obj.jobs = ['build_latex', 'forward_sync']
+            query_obj.jobs = ['check_build_cache', 'build_preamble', 'build_latex', 'forward_sync'] if use_precompiled_preamble else ['check_build_cache', 'build_latex', 'forward_sync']
             query_obj.build_data['text'] = text
             query_obj.build_data['latex_interpreter'] = interpreter
             query_obj.build_data['use_latexmk'] = use_latexmk
             query_obj.build_data['additional_arguments'] = additional_arguments
             query_obj.build_data['do_cleanup'] = do_cleanup
+            query_obj.build_data['use_build_cache'] = use_build_cache
+            query_obj.build_data['format_filename'] = None
             query_obj.can_sync = False
             query_obj.forward_sync_data['filename'] = synctex_arguments['filename']
             query_obj.forward_sync_data['line'] = synctex_arguments['line']
@@ -324,6 +482,7 @@ class BuildSystem(Observable):
 
     def stop_building(self, notify=True):
         if self.active_query != None:
+            self.active_query.force_building_to_stop = True
             self.active_query.jobs = []
             self.active_query = None
         for builder in self.builders.values():
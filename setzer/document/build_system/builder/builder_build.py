@@ -17,8 +17,11 @@
 
 import os
 import os.path
+import base64
 import shutil
 
+from setzer.app.service_locator import ServiceLocator
+
 
 class BuilderBuild(object):
 
@@ -29,6 +32,46 @@ class BuilderBuild(object):
         with query.build_result_lock:
             query.build_result = {'error': error,
                                  'error_arg': error_arg}
+        query.jobs = [job for job in query.jobs if job != 'build_latex']
+
+    def wait_for_process(self, query, process):
+        ''' Reaps the process with wait4, so its resource usage can go to
+            the span of the build profile that's open. '''
+
+        try:
+            pid, status, usage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            # reaped already when it was stopped.
+            process.wait()
+            return
+        process.returncode = os.waitstatus_to_exitcode(status)
+        query.build_profile.add_child_usage(usage)
+
+    def get_source_directory(self, query):
+        ''' Where the document's own files are, live previews and out of
+            tree builds run elsewhere. '''
+
+        source_directory = query.build_data.get('source_directory', None)
+        return source_directory if source_directory != None else os.path.dirname(query.tex_filename)
+
+    def get_environment(self, query):
+        environment = dict(os.environ)
+        # the trailing separator keeps the default search path.
+        if query.build_data.get('format_filename', None) != None:
+            environment['TEXFORMATS'] = os.path.dirname(query.build_data['format_filename']) + os.pathsep + environment.get('TEXFORMATS', '')
+        # the working directory comes first, it has the live snapshot of the
+        # files open in the editor, which must win over the saved ones.
+        if query.build_data.get('source_directory', None) != None:
+            for variable in ['TEXINPUTS', 'BIBINPUTS', 'BSTINPUTS', 'INDEXSTYLE']:
+                environment[variable] = '.' + os.pathsep + query.build_data['source_directory'] + os.pathsep + environment.get(variable, '')
+        return environment
+
+    def get_synctex_filename(self, tex_filename):
+        ''' Returns where the synctex file of a build is kept, it's copied
+            there so cleaning up build files doesn't break syncing. '''
+
+        folder = ServiceLocator.get_config_folder() + '/' + base64.urlsafe_b64encode(str.encode(tex_filename)).decode()
+        return folder + '/' + os.path.splitext(os.path.basename(tex_filename))[0] + '.synctex.gz'
 
     def cleanup_files(self, query):
         if query.build_data['do_cleanup']:
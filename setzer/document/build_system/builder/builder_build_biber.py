@@ -38,19 +38,17 @@ class BuilderBuildBiber(builder_build.BuilderBuild):
 
         query.biber_data['ran_on_files'].append(filename)
 
-        custom_env = os.environ.copy()
-        custom_env['BIBINPUTS'] = os.path.dirname(query.tex_filename) + ':' + os.path.dirname(tex_filename)
+        custom_env = self.get_environment(query)
+        custom_env['BIBINPUTS'] = os.path.dirname(query.tex_filename) + ':' + self.get_source_directory(query)
         try:
-            self.process = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=os.path.dirname(tex_filename), env=custom_env)
+            self.process = subprocess.Popen(arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=query.get_output_directory(), env=custom_env)
         except FileNotFoundError:
             self.cleanup_files(query)
             self.throw_build_error(query, 'interpreter_not_working', 'biber missing')
             return
-        self.process.wait()
+        self.wait_for_process(query, self.process)
 
-        self.parse_biber_log(query, tex_filename[:-3] + 'blg')
-
-        query.jobs.insert(0, 'build_latex')
+        self.parse_biber_log(query, query.get_output_filename('.blg'))
 
     def stop_running(self):
         if self.process != None:
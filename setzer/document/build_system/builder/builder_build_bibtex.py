@@ -42,15 +42,14 @@ class BuilderBuildBibTeX(builder_build.BuilderBuild):
         query.bibtex_data['ran_on_files'].append(filename)
 
         try:
-            self.process = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=os.path.dirname(tex_filename))
+            self.process = subprocess.Popen(arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=query.get_output_directory(), env=self.get_environment(query))
         except FileNotFoundError:
             self.cleanup_files(query)
             self.throw_build_error(query, 'interpreter_not_working', 'bibtex missing')
             return
-        self.process.wait()
+        self.wait_for_process(query, self.process)
 
-        self.parse_bibtex_log(query, tex_filename[:-3] + 'blg')
-        query.jobs.insert(0, 'build_latex')
+        self.parse_bibtex_log(query, query.get_output_filename('.blg'))
 
     def stop_running(self):
         if self.process != None:
@@ -17,7 +17,6 @@
 
 import os
 import os.path
-import shutil
 import subprocess
 
 import setzer.document.build_system.builder.builder_build as builder_build
@@ -34,20 +33,15 @@ class BuilderBuildGlossaries(builder_build.BuilderBuild):
         basename = os.path.basename(tex_filename).rsplit('.', 1)[0]
         arguments = ['makeglossaries']
         arguments.append(basename)
+
+        query.glossaries_data['ran_on_files'].append(basename)
         try:
-            self.process = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=os.path.dirname(tex_filename))
+            self.process = subprocess.Popen(arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=query.get_output_directory(), env=self.get_environment(query))
         except FileNotFoundError:
             self.cleanup_files(query)
             self.throw_build_error(query, 'interpreter_not_working', 'makeglossaries missing')
             return
-        self.process.wait()
-        for ending in ['.gls', '.acr']:
-            move_from = os.path.join(os.path.dirname(tex_filename), basename + ending)
-            move_to = os.path.join(os.path.dirname(query.tex_filename), basename + ending)
-            try: shutil.move(move_from, move_to)
-            except FileNotFoundError: pass
-
-        query.jobs.insert(0, 'build_latex')
+        self.wait_for_process(query, self.process)
 
     def stop_running(self):
         if self.process != None:
@@ -18,9 +18,10 @@
 import os
 import os.path
 import sys
-import base64
+import errno
 import shutil
 import pexpect
+import ptyprocess
 from operator import itemgetter
 
 import setzer.document.build_system.builder.builder_build as builder_build
@@ -28,86 +29,177 @@ import setzer.document.build_system.latex_log_parser.latex_log_parser as latex_l
 from setzer.app.service_locator import ServiceLocator
 
 
+class PtyProcess(ptyprocess.PtyProcess):
+    ''' Reaps the child with wait4 instead of waitpid, pexpect does it
+        itself at the end of the output, the resource usage would be lost. '''
+
+    def __init__(self, pid, fd):
+        ptyprocess.PtyProcess.__init__(self, pid, fd)
+        self.usage = None
+
+    def isalive(self):
+        if not self.terminated:
+            self.reap(0 if self.flag_eof else os.WNOHANG)
+        return not self.terminated
+
+    def wait(self):
+        if not self.terminated:
+            self.reap(0)
+        return self.exitstatus
+
+    def reap(self, options):
+        pid, status, usage = os.wait4(self.pid, options)
+        if pid == 0: return
+
+        self.status = status
+        self.usage = usage
+        if os.WIFSIGNALED(status):
+            self.exitstatus = None
+            self.signalstatus = os.WTERMSIG(status)
+        else:
+            self.exitstatus = os.WEXITSTATUS(status)
+            self.signalstatus = None
+        self.terminated = True
+
+
+class Spawn(pexpect.spawn):
+
+    def _spawnpty(self, args, **kwargs):
+        return PtyProcess.spawn(args, **kwargs)
+
+
 class BuilderBuildLaTeX(builder_build.BuilderBuild):
 
-    def __init__(self):
+    def __init__(self, build_cache, build_planner):
         builder_build.BuilderBuild.__init__(self)
 
+        self.build_cache = build_cache
+        self.build_planner = build_planner
         self.config_folder = ServiceLocator.get_config_folder()
         self.latex_log_parser = latex_log_parser.LaTeXLogParser()
+        self.max_mirrored_folders = 256
 
     def run(self, query):
         build_command_defaults = dict()
-        build_command_defaults['pdflatex'] = 'pdflatex -synctex=1 -interaction=nonstopmode'
-        build_command_defaults['xelatex'] = 'xelatex -synctex=1 -interaction=nonstopmode'
-        build_command_defaults['lualatex'] = 'lualatex --synctex=1 --interaction=nonstopmode'
+        build_command_defaults['pdflatex'] = 'pdflatex -synctex=1 -interaction=nonstopmode -recorder'
+        build_command_defaults['xelatex'] = 'xelatex -synctex=1 -interaction=nonstopmode -recorder'
+        build_command_defaults['lualatex'] = 'lualatex --synctex=1 --interaction=nonstopmode --recorder'
         build_command_defaults['tectonic'] = 'tectonic --synctex --keep-logs'
+        draft_mode_options = {'pdflatex': ' -draftmode', 'xelatex': ' -no-pdf', 'lualatex': ' --draftmode'}
+
+        if query.build_data['latex_passes'] == 0:
+            self.create_output_directory(query)
+            self.build_planner.plan_first_pass(query)
 
         latex_interpreter = query.build_data['latex_interpreter']
         if latex_interpreter == 'tectonic':
             build_command = build_command_defaults[latex_interpreter]
-            build_command += ' --outdir "' + os.path.dirname(query.tex_filename) + '" "' 
+            build_command += ' --outdir "' + query.get_output_directory() + '" "'
         elif query.build_data['use_latexmk']:
             if latex_interpreter == 'pdflatex':
                 interpreter_option = 'pdf'
             else:
                 interpreter_option = latex_interpreter
-            build_command = 'latexmk -' + interpreter_option + ' -synctex=1 -interaction=nonstopmode'
+            build_command = 'latexmk -' + interpreter_option + ' -synctex=1 -interaction=nonstopmode -recorder'
             build_command += query.build_data['additional_arguments']
-            build_command += ' -output-directory="' + os.path.dirname(query.tex_filename) + '" "'
+            build_command += self.get_jobname_option(query)
+            build_command += ' -output-directory="' + query.get_output_directory() + '" "'
         else:
             build_command = build_command_defaults[latex_interpreter]
+            if query.build_data['format_filename'] != None:
+                build_command += ' -fmt=' + os.path.basename(query.build_data['format_filename'])[:-4]
+            if query.build_data['draft_pass']:
+                build_command += draft_mode_options[latex_interpreter]
             build_command += query.build_data['additional_arguments']
-            build_command += ' -output-directory="' + os.path.dirname(query.tex_filename) + '" "'
-        build_command += query.tex_filename + '"'
+            build_command += self.get_jobname_option(query)
+            build_command += ' -output-directory="' + query.get_output_directory() + '" "'
+        build_command += self.get_input_filename(query) + '"'
 
-        try:
-            self.process = pexpect.spawn(build_command, cwd=os.path.dirname(query.tex_filename))
-        except pexpect.exceptions.ExceptionPexpect:
-            self.cleanup_files(query)
-            self.throw_build_error(query, 'interpreter_missing', latex_interpreter)
-            return
+        aux_state = self.build_planner.get_aux_state(query)
+        query.build_data['latex_passes'] += 1
+        span_name = 'run_interpreter, pass ' + str(query.build_data['latex_passes'])
+        if query.build_data['draft_pass']:
+            span_name += ', draft'
+        with query.build_profile.span(span_name):
+            try:
+                self.process = Spawn(build_command, cwd=os.path.dirname(query.tex_filename), env=self.get_environment(query))
+            except pexpect.exceptions.ExceptionPexpect:
+                self.cleanup_files(query)
+                self.throw_build_error(query, 'interpreter_missing', latex_interpreter)
+                return
+
+            output = b''
+            while True:
+                try:
+                    out = self.process.expect(['\r\n\r\n', pexpect.TIMEOUT, pexpect.EOF], timeout=20)
+                except AttributeError:
+                    break
+                # only needed to tell if the format loaded.
+                if out != 1 and query.build_data['format_filename'] != None:
+                    output += self.process.before
+                if out == 0:
+                    pass
+                elif out == 1:
+                    for line in self.process.before.split(b'\n'):
+                        if line.startswith(b'!'):
+                            self.process.sendcontrol('c')
+                            self.process.sendline('x')
+                else:
+                    break
 
-        while True:
             try:
-                out = self.process.expect(['\r\n\r\n', pexpect.TIMEOUT, pexpect.EOF], timeout=20)
-            except AttributeError:
-                break
-            if out == 0:
-                pass
-            elif out == 1:
-                for line in self.process.before.split(b'\n'):
-                    if line.startswith(b'!'):
-                        self.process.sendcontrol('c')
-                        self.process.sendline('x')
-            else:
-                break
+                self.process.wait()
+                query.build_profile.add_child_usage(self.process.ptyproc.usage)
+            except (AttributeError, OSError, pexpect.exceptions.ExceptionPexpect): pass
+
+        # formats of an older TeX installation don't load, build without.
+        if query.build_data['format_filename'] != None and output.find(b'Fatal format file error') >= 0:
+            self.drop_format(query)
+            query.build_data['latex_passes'] -= 1
+            query.jobs.insert(0, 'build_latex')
+            return
 
         # parse results
         try:
-            if self.parse_build_log(query):
-                return
+            with query.build_profile.span('parse_log'):
+                if self.parse_build_log(query, aux_state):
+                    return
         except FileNotFoundError as e:
             self.cleanup_files(query)
             self.throw_build_error(query, 'interpreter_not_working', 'log file missing')
             return
 
-        query.can_sync = self.copy_synctex_file(query)
-        self.cleanup_files(query)
+        with query.build_profile.span('copy_synctex'):
+            query.can_sync = self.copy_synctex_file(query)
 
-        pdf_filename = query.tex_filename.rsplit('.tex', 1)[0] + '.pdf'
+        pdf_filename = os.path.splitext(query.tex_filename)[0] + '.pdf'
         if query.error_count > 0:
-            if os.path.isfile(pdf_filename):
-                os.remove(pdf_filename)
+            for filename in {query.get_output_filename('.pdf'), pdf_filename}:
+                try: os.remove(filename)
+                except FileNotFoundError: pass
             pdf_filename = None
+        elif self.is_out_of_tree(query):
+            try: self.move_file(query.get_output_filename('.pdf'), pdf_filename)
+            except FileNotFoundError: pdf_filename = None
+
+        build_result = {'pdf_filename': pdf_filename, 
+                        'has_synctex_file': query.can_sync,
+                        'log_messages': query.log_messages,
+                        'bibtex_log_messages': query.bibtex_log_messages,
+                        'error': None,
+                        'error_arg': None}
+
+        # the recorder file is gone after cleaning up.
+        with query.build_profile.span('store_build_cache'):
+            if query.build_data['use_build_cache'] and pdf_filename != None and os.path.isfile(pdf_filename):
+                self.build_cache.add_build_result(query, build_result)
+            else:
+                self.build_cache.remove_build_result(query.tex_filename)
+        with query.build_profile.span('cleanup'):
+            self.cleanup_files(query)
 
         with query.build_result_lock:
-            query.build_result = {'pdf_filename': pdf_filename, 
-                                  'has_synctex_file': query.can_sync,
-                                  'log_messages': query.log_messages,
-                                  'bibtex_log_messages': query.bibtex_log_messages,
-                                  'error': None,
-                                  'error_arg': None}
+            query.build_result = build_result
 
     def stop_running(self):
         if self.process != None:
@@ -116,16 +208,14 @@ class BuilderBuildLaTeX(builder_build.BuilderBuild):
             self.process.terminate(True)
             self.process = None
 
-    def parse_build_log(self, query):
+    def parse_build_log(self, query, aux_state):
         query.log_messages = list()
         query.error_count = 0
 
-        log_items = self.latex_log_parser.parse_build_log(query.tex_filename)
-        additional_jobs = self.latex_log_parser.get_additional_jobs(log_items, query)
-        file_no = 0
-
-        for job in additional_jobs:
-            query.jobs.insert(0, job)
+        log_items = self.latex_log_parser.parse_build_log(query.tex_filename, query.get_output_filename('.log'))
+        next_jobs = self.build_planner.get_next_jobs(query, log_items, aux_state)
+        if len(next_jobs) > 0:
+            query.jobs = next_jobs + query.jobs
             return True
 
         for filename, items in log_items.items():
@@ -138,15 +228,76 @@ class BuilderBuildLaTeX(builder_build.BuilderBuild):
         return False
 
     def copy_synctex_file(self, query):
-        move_from = os.path.splitext(query.tex_filename)[0] + '.synctex.gz'
-        folder = self.config_folder + '/' + base64.urlsafe_b64encode(str.encode(query.tex_filename)).decode()
-        move_to = folder + '/' + os.path.splitext(os.path.basename(query.tex_filename))[0] + '.synctex.gz'
+        move_from = query.get_output_filename('.synctex.gz')
+        move_to = self.get_synctex_filename(query.tex_filename)
+        folder = os.path.dirname(move_to)
 
         if not os.path.exists(folder):
             os.makedirs(folder)
 
-        try: shutil.copyfile(move_from, move_to)
+        try:
+            if self.is_out_of_tree(query):
+                self.move_file(move_from, move_to)
+            else:
+                shutil.copyfile(move_from, move_to)
         except FileNotFoundError: return False
         else: return True
 
+    def get_input_filename(self, query):
+        ''' Fast builds run a wrapper putting \\includeonly in front of the
+            document, under the document's job name. '''
+
+        if query.build_data.get('include_only', None) == None: return query.tex_filename
+
+        wrapper_filename = query.build_data['include_only_wrapper']
+        os.makedirs(os.path.dirname(wrapper_filename), exist_ok=True)
+        with open(wrapper_filename, 'w') as f:
+            f.write('\\includeonly{' + query.build_data['include_only'] + '}\n\\input{' + query.tex_filename + '}\n')
+        return wrapper_filename
+
+    def get_jobname_option(self, query):
+        if query.build_data.get('include_only', None) == None: return ''
+        return ' -jobname="' + os.path.splitext(os.path.basename(query.tex_filename))[0] + '"'
+
+    def drop_format(self, query):
+        ''' Marks the format as failed, like BuilderBuildPreamble does for
+            formats that can't be made. '''
+
+        format_filename = query.build_data['format_filename']
+        query.build_data['format_filename'] = None
+        try: os.remove(format_filename)
+        except FileNotFoundError: pass
+        try: open(os.path.splitext(format_filename)[0] + '.failed', 'w').close()
+        except OSError: pass
+
+    def is_out_of_tree(self, query):
+        return query.get_output_directory() != os.path.dirname(query.tex_filename)
+
+    def create_output_directory(self, query):
+        ''' Mirrors the folders below the document into the build
+            directory, latex writes the aux files of included files next
+            to them and doesn't create folders itself. '''
+
+        if not self.is_out_of_tree(query): return
+
+        source_directory = os.path.dirname(query.tex_filename)
+        output_directory = query.get_output_directory()
+        os.makedirs(output_directory, exist_ok=True)
+
+        count = 0
+        for dirpath, dirnames, filenames in os.walk(source_directory):
+            dirnames[:] = [dirname for dirname in dirnames if not dirname.startswith('.')]
+            for dirname in dirnames:
+                os.makedirs(os.path.join(output_directory, os.path.relpath(os.path.join(dirpath, dirname), source_directory)), exist_ok=True)
+                count += 1
+                if count >= self.max_mirrored_folders: return
+
+    def move_file(self, move_from, move_to):
+        ''' Renames if the build directory is on the same file system. '''
+
+        try: os.replace(move_from, move_to)
+        except OSError as e:
+            if e.errno != errno.EXDEV: raise e
+            shutil.move(move_from, move_to)
+
 
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import os
+import os.path
+import hashlib
+import shutil
+import subprocess
+
+import setzer.document.build_system.builder.builder_build as builder_build
+from setzer.app.service_locator import ServiceLocator
+
+
+class BuilderBuildPreamble(builder_build.BuilderBuild):
+    ''' Dumps the preamble of the document into a format file with
+        mylatexformat. Builds loading this format skip the preamble, so
+        they only pay for the body. Formats are cached by a hash of the
+        preamble and the local files it loads, and reused across builds
+        until the preamble changes. '''
+
+    def __init__(self):
+        builder_build.BuilderBuild.__init__(self)
+
+        self.formats_folder = os.path.join(ServiceLocator.get_config_folder(), 'formats')
+        self.max_formats = 8
+        self.engine_filenames = None
+        self.document_begin_regex = ServiceLocator.get_regex_object(r'(?m)^(?:[^%\n\\]|\\.)*?\\begin\{document\}')
+        self.local_file_regex = ServiceLocator.get_regex_object(r'\\(?:documentclass|usepackage|RequirePackage|input|include)(?:\[[^\]]*\])?\{([^\}]*)\}')
+
+    def run(self, query):
+        query.build_data['format_filename'] = None
+        if query.build_data['latex_interpreter'] != 'pdflatex' or query.build_data['use_latexmk']: return
+
+        try:
+            with open(query.tex_filename, 'r') as f:
+                text = f.read()
+        except (IOError, UnicodeDecodeError): return
+        match = self.document_begin_regex.search(text)
+        if match == None: return
+        preamble_end = match.end() - len('\\begin{document}')
+
+        format_name = self.get_format_name(query, text[:preamble_end])
+        format_filename = os.path.join(self.formats_folder, format_name + '.fmt')
+        if os.path.isfile(format_filename):
+            os.utime(format_filename)
+            query.build_data['format_filename'] = format_filename
+            return
+        if os.path.isfile(os.path.join(self.formats_folder, format_name + '.failed')): return
+
+        if not os.path.exists(self.formats_folder):
+            os.makedirs(self.formats_folder)
+
+        arguments = ['pdflatex', '-ini', '-interaction=nonstopmode', '-jobname=' + format_name, '-output-directory=' + self.formats_folder]
+        arguments += query.build_data['additional_arguments'].split()
+        arguments += ['&pdflatex', 'mylatexformat.ltx', query.tex_filename]
+        try:
+            self.process = subprocess.Popen(arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=os.path.dirname(query.tex_filename), env=self.get_environment(query))
+        except FileNotFoundError:
+            return
+        self.wait_for_process(query, self.process)
+        returncode = self.process.returncode if self.process != None else -1
+        self.process = None
+
+        for ending in ['.log', '.aux']:
+            try: os.remove(os.path.join(self.formats_folder, format_name + ending))
+            except FileNotFoundError: pass
+
+        if returncode == 0 and os.path.isfile(format_filename):
+            query.build_data['format_filename'] = format_filename
+            self.remove_old_formats()
+        elif not query.force_building_to_stop:
+            # don't try again for the same preamble, build without format.
+            try: os.remove(format_filename)
+            except FileNotFoundError: pass
+            open(os.path.join(self.formats_folder, format_name + '.failed'), 'w').close()
+            self.remove_old_formats()
+
+    def stop_running(self):
+        if self.process != None:
+            self.process.kill()
+            self.process = None
+
+    def get_format_name(self, query, preamble):
+        ''' The format depends on the preamble, the build options, the
+            TeX installation and the local files (classes, packages,
+            inputs) loaded in it. '''
+
+        dirname = self.get_source_directory(query)
+        data = [query.build_data['latex_interpreter'], query.build_data['additional_arguments'], preamble]
+        data += self.get_engine_data()
+        for match in self.local_file_regex.finditer(preamble):
+            for name in match.group(1).split(','):
+                for ending in ['', '.tex', '.sty', '.cls']:
+                    filename = os.path.join(dirname, name.strip() + ending)
+                    if os.path.isfile(filename):
+                        stat = os.stat(filename)
+                        data.append(filename + ':' + str(stat.st_mtime) + ':' + str(stat.st_size))
+        return 'preamble-' + hashlib.sha1('\n'.join(data).encode('utf-8')).hexdigest()[:20]
+
+    def get_engine_data(self):
+        ''' Formats only load into the engine and base format they were
+            made with, a TeX update changes their modification times. '''
+
+        if self.engine_filenames == None:
+            self.engine_filenames = [shutil.which('pdflatex')]
+            try:
+                output = subprocess.run(['kpsewhich', '-engine=pdftex', 'pdflatex.fmt'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=10).stdout
+            except (OSError, subprocess.SubprocessError):
+                output = b''
+            self.engine_filenames.append(output.decode('utf-8', errors='ignore').strip())
+
+        data = list()
+        for filename in self.engine_filenames:
+            if not filename: continue
+            try: stat = os.stat(filename)
+            except OSError: continue
+            data.append(filename + ':' + str(stat.st_mtime) + ':' + str(stat.st_size))
+        return data
+
+    def remove_old_formats(self):
+        ''' Keeps the most recently used formats, and as many markers of
+            failed ones. '''
+
+        for ending in ['.fmt', '.failed']:
+            filenames = list()
+            for filename in os.listdir(self.formats_folder):
+                if not filename.endswith(ending): continue
+                pathname = os.path.join(self.formats_folder, filename)
+                try: filenames.append((os.path.getmtime(pathname), pathname))
+                except FileNotFoundError: pass
+            filenames.sort(reverse=True)
+            for mtime, pathname in filenames[self.max_formats:]:
+                try: os.remove(pathname)
+                except FileNotFoundError: pass
+
+
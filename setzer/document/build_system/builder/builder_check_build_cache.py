@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+
+import setzer.document.build_system.builder.builder_build as builder_build
+
+
+class BuilderCheckBuildCache(builder_build.BuilderBuild):
+    ''' Skips building if the inputs haven't changed since the last
+        successful build, the result of that build is reused. '''
+
+    def __init__(self, build_cache):
+        builder_build.BuilderBuild.__init__(self)
+
+        self.build_cache = build_cache
+
+    def run(self, query):
+        if not query.build_data['use_build_cache']: return
+
+        build_result = self.build_cache.get_build_result(query, self.get_synctex_filename(query.tex_filename))
+        if build_result == None: return
+
+        query.jobs = [job for job in query.jobs if job not in ['build_preamble', 'build_latex']]
+        query.can_sync = build_result['has_synctex_file']
+        with query.build_result_lock:
+            query.build_result = build_result
+
+    def stop_running(self):
+        pass
+
+
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+
+import gi
+from gi.repository import GObject, GLib
+
+import os
+import os.path
+import base64
+import glob
+
+from setzer.app.service_locator import ServiceLocator
+
+
+class LivePreview():
+    ''' Builds the document from the text in the editor, shortly after
+        typing stops, if live preview is switched on.
+
+        The text of the document and of the open documents in its folder
+        goes to a scratch folder in the user's cache, the build runs
+        there and reads everything else from the document's folder.
+        A newer snapshot cancels the build of an older one. Only pdfs of
+        successful builds are shown, the user's files aren't touched. '''
+
+    def __init__(self, build_system):
+        self.build_system = build_system
+        self.document = build_system.document
+        self.settings = ServiceLocator.get_settings()
+
+        self.debounce_delay = 750
+        self.change_count = 0
+        self.snapshot_filenames = set()
+        self.pdf_count = 0
+
+        self.document.connect('changed', self.on_change)
+
+    def on_change(self, document):
+        if not self.settings.get_value('preferences', 'live_preview'): return
+        if not self.document.source_buffer.get_modified(): return
+
+        self.change_count += 1
+        GObject.timeout_add(self.debounce_delay, self.on_debounce_timeout, self.change_count)
+
+    def on_debounce_timeout(self, change_count):
+        if change_count != self.change_count: return False
+
+        document = ServiceLocator.get_workspace().get_root_or_active_latex_document()
+        if document == None or document.filename == None: return False
+
+        # don't interrupt builds the user started, try again after them.
+        return not document.build_system.start_live_build()
+
+    def get_scratch_folder(self):
+        return os.path.join(GLib.get_user_cache_dir(), 'setzer', 'live', base64.urlsafe_b64encode(str.encode(self.document.get_filename())).decode())
+
+    def write_snapshot(self):
+        ''' Writes the open documents in the folder of the document (and
+            below) to the scratch folder, returns the filename of the
+            document there. '''
+
+        dirname = self.document.get_dirname()
+        scratch_folder = self.get_scratch_folder()
+        filenames = set()
+        for document in ServiceLocator.get_workspace().open_documents:
+            if document.get_filename() == None: continue
+            relative_filename = os.path.relpath(document.get_filename(), dirname)
+            if relative_filename.startswith('..'): continue
+
+            filename = os.path.join(scratch_folder, relative_filename)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'w') as f:
+                f.write(document.get_all_text())
+            filenames.add(filename)
+
+        # documents closed since the last snapshot are read from disk again.
+        for filename in self.snapshot_filenames - filenames:
+            try: os.remove(filename)
+            except FileNotFoundError: pass
+        self.snapshot_filenames = filenames
+
+        return os.path.join(scratch_folder, os.path.basename(self.document.get_filename()))
+
+    def keep_pdf(self, pdf_filename):
+        ''' Moves the pdf of a live build out of the way of the next one,
+            so the preview can read it while LaTeX is writing. Returns the
+            new filename. '''
+
+        self.pdf_count += 1
+        basename = os.path.splitext(pdf_filename)[0]
+        new_filename = basename + '-live-' + str(self.pdf_count) + '.pdf'
+        os.replace(pdf_filename, new_filename)
+
+        # pdfs the preview still has open stay readable after removing them.
+        for filename in glob.glob(glob.escape(basename) + '-live-*.pdf'):
+            if filename != new_filename:
+                try: os.remove(filename)
+                except FileNotFoundError: pass
+        return new_filename
+
+
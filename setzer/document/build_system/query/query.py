@@ -16,6 +16,7 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
 import _thread as thread
+import os.path
 
 
 class Query(object):
@@ -29,13 +30,16 @@ class Query(object):
         self.backward_sync_result_lock = thread.allocate_lock()
         self.done_executing = False
         self.done_executing_lock = thread.allocate_lock()
+        self.finished_lock = thread.allocate_lock()
+        self.finished_lock.acquire()
         self.synctex_file = None
         self.synctex_file_lock = thread.allocate_lock()
 
-        self.build_data = {'rerun_latex_reasons': set()}
+        self.build_data = {'latex_passes': 0, 'draft_pass': False}
         self.biber_data = {'ran_on_files': []}
         self.bibtex_data = {'ran_on_files': []}
         self.makeindex_data = {'ran_on_files': []}
+        self.glossaries_data = {'ran_on_files': []}
         self.can_sync = False
         self.forward_sync_data = dict()
         self.backward_sync_data = dict()
@@ -44,8 +48,21 @@ class Query(object):
         self.log_messages = dict()
         self.bibtex_log_messages = {'error': list(), 'warning': list(), 'badbox': list()}
         self.force_building_to_stop = False
+        self.build_profile = None
+        self.is_live = False
         self.error_count = 0
 
+    def get_output_directory(self):
+        ''' Where the interpreter writes its files, the document's folder
+            unless the build runs out of tree. '''
+
+        output_directory = self.build_data.get('output_directory', None)
+        return output_directory if output_directory != None else os.path.dirname(self.tex_filename)
+
+    def get_output_filename(self, ending):
+        basename = os.path.splitext(os.path.basename(self.tex_filename))[0]
+        return os.path.join(self.get_output_directory(), basename + ending)
+
     def get_build_result(self):
         return_value = None
         with self.build_result_lock:
@@ -70,6 +87,11 @@ class Query(object):
     def mark_done(self):
         with self.done_executing_lock:
             self.done_executing = True
+        self.finished_lock.release()
+
+    def wait_until_done(self):
+        with self.finished_lock:
+            pass
     
     def is_done(self):
         with self.done_executing_lock:
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import _thread as thread
+import array
+import bisect
+import gzip
+import os
+import os.path
+
+
+class SyncTeXReader():
+    ''' Holds the SyncTeXIndex of a document and reloads it when the
+        synctex file has changed, going by modification time and size.
+        Loading happens in the thread that asks for the index. '''
+
+    def __init__(self):
+        self.index = None
+        self.index_key = None
+        self.lock = thread.allocate_lock()
+
+    def get_index(self, filename):
+        with self.lock:
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                self.index, self.index_key = None, None
+                return None
+
+            key = (filename, stat.st_mtime_ns, stat.st_size)
+            if key != self.index_key:
+                try:
+                    self.index = SyncTeXIndex(filename)
+                except (OSError, EOFError, ValueError, IndexError):
+                    self.index = None
+                self.index_key = key
+            return self.index
+
+
+class SyncTeXIndex():
+    ''' Reads a .synctex.gz file into flat arrays, for forward and
+        backward search without the synctex binary.
+
+        Every horizontal box on a page becomes a box with its position
+        and size in scaled points. Records inside a box (glyphs, kerns,
+        glue, math) keep their horizontal position, input file and line.
+        forward_index maps (input, line) to the boxes with material from
+        that line, page_boxes lists the boxes of each page sorted by their
+        top, for bisection. '''
+
+    def __init__(self, filename):
+        self.inputs = dict()
+        self.magnification = 1000
+        self.unit = 1
+        self.x_offset = 0
+        self.y_offset = 0
+
+        self.box_page = array.array('l')
+        self.box_h = array.array('l')
+        self.box_v = array.array('l')
+        self.box_width = array.array('l')
+        self.box_height = array.array('l')
+        self.box_depth = array.array('l')
+        self.box_tag = array.array('l')
+        self.box_line = array.array('l')
+        self.box_records = list()
+
+        self.record_h = array.array('l')
+        self.record_tag = array.array('l')
+        self.record_line = array.array('l')
+
+        self.forward_index = dict()
+        self.page_boxes = dict()
+
+        with gzip.open(filename, 'rt', encoding='utf-8', errors='replace') as synctex_file:
+            self.parse(synctex_file)
+
+        self.factor = self.unit * self.magnification / 1000 / 65781.76
+        self.max_box_height = dict()
+        for page, boxes in self.page_boxes.items():
+            boxes.sort(key=lambda box: self.box_v[box] - self.box_height[box])
+            self.page_boxes[page] = (array.array('l', boxes), array.array('l', (self.box_v[box] - self.box_height[box] for box in boxes)))
+            self.max_box_height[page] = max((self.box_height[box] + self.box_depth[box] for box in boxes), default=0)
+
+    def parse(self, synctex_file):
+        page = 0
+        box_stack = list()
+        in_content = False
+
+        for line in synctex_file:
+            first_char = line[:1]
+
+            if not in_content:
+                if line.startswith('Input:'):
+                    self.add_input(line)
+                elif line.startswith('Magnification:'):
+                    self.magnification = float(line[14:]) or 1000
+                elif line.startswith('Unit:'):
+                    self.unit = float(line[5:]) or 1
+                elif line.startswith('X Offset:'):
+                    self.x_offset = float(line[9:])
+                elif line.startswith('Y Offset:'):
+                    self.y_offset = float(line[9:])
+                elif line.startswith('Content:'):
+                    in_content = True
+
+            elif first_char in 'xkg$':
+                if len(box_stack) == 0 or box_stack[-1] == None: continue
+                box = box_stack[-1]
+                link, point = line[1:].split(':', 2)[:2]
+                tag, line_number = link.split(',')
+                tag, line_number = int(tag), int(line_number)
+                self.box_records[box].append(len(self.record_h))
+                self.record_h.append(int(point.split(',')[0]))
+                self.record_tag.append(tag)
+                self.record_line.append(line_number)
+                self.add_to_forward_index(tag, line_number, box)
+
+            elif first_char in '(h':
+                box = self.add_box(page, line)
+                if first_char == '(':
+                    box_stack.append(box)
+            elif first_char == ')':
+                if len(box_stack) > 0: box_stack.pop()
+            elif first_char == '[':
+                box_stack.append(None)
+            elif first_char == ']':
+                if len(box_stack) > 0: box_stack.pop()
+            elif first_char == '{':
+                page = int(line[1:])
+                box_stack = list()
+            elif line.startswith('Input:'):
+                self.add_input(line)
+            elif line.startswith('Postamble:'):
+                in_content = False
+
+    def add_input(self, line):
+        tag, filename = line[6:].rstrip('\n').split(':', 1)
+        self.inputs[int(tag)] = os.path.normpath(filename)
+
+    def add_box(self, page, line):
+        link, point, size = line[1:].split(':', 3)[:3]
+        tag, line_number = link.split(',')
+        h, v = point.split(',')
+        width, height, depth = size.split(',')[:3]
+
+        box = len(self.box_h)
+        self.box_page.append(page)
+        self.box_h.append(int(h))
+        self.box_v.append(int(v))
+        self.box_width.append(int(width))
+        self.box_height.append(int(height))
+        self.box_depth.append(int(depth))
+        self.box_tag.append(int(tag))
+        self.box_line.append(int(line_number))
+        self.box_records.append(list())
+        try:
+            self.page_boxes[page].append(box)
+        except KeyError:
+            self.page_boxes[page] = [box]
+        self.add_to_forward_index(int(tag), int(line_number), box)
+        return box
+
+    def add_to_forward_index(self, tag, line_number, box):
+        try:
+            boxes = self.forward_index[(tag, line_number)]
+        except KeyError:
+            self.forward_index[(tag, line_number)] = [box]
+        else:
+            if boxes[-1] != box:
+                boxes.append(box)
+
+    def get_tag(self, filename):
+        filename = os.path.normpath(filename)
+        for tag, input_filename in self.inputs.items():
+            if input_filename == filename:
+                return tag
+        for tag, input_filename in self.inputs.items():
+            if os.path.basename(input_filename) == os.path.basename(filename):
+                return tag
+        return None
+
+    def forward_search(self, filename, line_number, max_distance=100):
+        ''' Returns a list of rectangles {page, h, v, width, height} in
+            big points for the boxes with material from the given line,
+            or from the closest line after it. v is the bottom edge. '''
+
+        tag = self.get_tag(filename)
+        if tag == None: return list()
+
+        for distance in range(max_distance):
+            boxes = self.forward_index.get((tag, line_number + distance))
+            if boxes == None and distance > 0:
+                boxes = self.forward_index.get((tag, line_number - distance))
+            if boxes != None: break
+        else:
+            return list()
+
+        rectangles = list()
+        for box in boxes:
+            rectangle = dict()
+            rectangle['page'] = self.box_page[box]
+            rectangle['h'] = (self.box_h[box] + self.x_offset) * self.factor
+            rectangle['v'] = (self.box_v[box] + self.box_depth[box] + self.y_offset) * self.factor
+            rectangle['width'] = self.box_width[box] * self.factor
+            rectangle['height'] = (self.box_height[box] + self.box_depth[box]) * self.factor
+            rectangles.append(rectangle)
+        return rectangles
+
+    def backward_search(self, page, x, y):
+        ''' Takes a point in big points from the top left corner of a page,
+            returns (filename, line) of the material closest to it, or
+            None. The smallest box containing the point is chosen, or the
+            nearest box if there is none. '''
+
+        if page not in self.page_boxes: return None
+        boxes, tops = self.page_boxes[page]
+        h, v = x / self.factor - self.x_offset, y / self.factor - self.y_offset
+
+        best_box, best_distance, best_area = None, None, None
+        start = bisect.bisect_left(tops, v - self.max_box_height[page])
+        end = bisect.bisect_right(tops, v)
+        for box in boxes[start:end]:
+            if self.box_h[box] <= h <= self.box_h[box] + self.box_width[box] and v <= self.box_v[box] + self.box_depth[box]:
+                area = self.box_width[box] * (self.box_height[box] + self.box_depth[box])
+                if best_distance != 0 or area < best_area:
+                    best_box, best_distance, best_area = box, 0, area
+
+        if best_box == None:
+            for box in boxes:
+                dx = max(self.box_h[box] - h, 0, h - self.box_h[box] - self.box_width[box])
+                dy = max(self.box_v[box] - self.box_height[box] - v, 0, v - self.box_v[box] - self.box_depth[box])
+                distance = dx * dx + dy * dy
+                if best_distance == None or distance < best_distance:
+                    best_box, best_distance = box, distance
+        if best_box == None: return None
+
+        tag, line_number = self.box_tag[best_box], self.box_line[best_box]
+        records = self.box_records[best_box]
+        if len(records) > 0:
+            record = records[0]
+            for candidate in records:
+                if self.record_h[candidate] <= h and self.record_h[candidate] >= self.record_h[record]:
+                    record = candidate
+            tag, line_number = self.record_tag[record], self.record_line[record]
+
+        if tag not in self.inputs: return None
+        return (self.inputs[tag], line_number)
+
+
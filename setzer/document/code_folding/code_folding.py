@@ -50,21 +50,16 @@ class CodeFolding(Observable):
         # amount of text inserted or deleted). these updated positions
         # will be used in the algorithm further below.
 
+        # the parser may combine several edits into one update,
+        # last_parsed_edit is the text range covering all of them.
+
         folding_regions = dict()
-        if parser.last_edit[0] == 'insert':
-            _, location_iter, text, text_length = parser.last_edit
-            length = len(text)
-            offset_start = location_iter.get_offset() + length - 1
-            offset_end = offset_start + 1
-        elif parser.last_edit[0] == 'delete':
-            _, start_iter, end_iter = parser.last_edit
-            offset_start = start_iter.get_offset()
-            offset_end = end_iter.get_offset()
-            length = offset_start - offset_end
+        offset_start, offset_end_before, offset_end_after = parser.last_parsed_edit
+        length = offset_end_after - offset_end_before
         for index, region in self.folding_regions.items():
-            if index <= offset_start:
+            if index < offset_start:
                 folding_regions[index] = region
-            elif index >= offset_end:
+            elif index >= offset_end_before:
                 folding_regions[index + length] = region
 
         # now update the folding regions w.r.t. the new parsing results.
@@ -155,7 +150,8 @@ class CodeFolding(Observable):
     def set_initial_folded_regions(self, folded_regions):
         if self.settings.get_value('preferences', 'enable_code_folding'):
             self.initial_folded_regions = folded_regions
-            self.initial_folding()
+            if self.document.parser.is_up_to_date():
+                self.initial_folding()
 
     def initial_folding(self):
         if self.initial_folded_regions != None:
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import bisect
+
+
+class MatchIndex():
+    ''' Keeps parser matches ordered by offset, split in two at a
+        movable gap. Matches in front of the gap (head) store their
+        absolute offset and line number, matches behind it (tail) store
+        them relative to the end of the text, in reverse order.
+
+        Edits are applied at the gap, so inserting or deleting text
+        only touches the matches in the edited range. Typing at one
+        place moves the gap by a few matches at most. '''
+
+    def __init__(self):
+        self.head = list()
+        self.tail = list()
+        self.text_length = 0
+        self.number_of_lines = 0
+
+    def move_gap(self, offset):
+        head, tail = self.head, self.tail
+
+        while len(head) > 0 and head[-1][0] >= offset:
+            item_offset, line, kind, match = head.pop()
+            tail.append((self.text_length - item_offset, self.number_of_lines - line, kind, match))
+        while len(tail) > 0 and self.text_length - tail[-1][0] < offset:
+            distance_to_end, lines_to_end, kind, match = tail.pop()
+            head.append((self.text_length - distance_to_end, self.number_of_lines - lines_to_end, kind, match))
+
+    def replace_range(self, offset_start, offset_end, length_difference, line_difference, items):
+        ''' Removes all matches with offset_start <= offset <= offset_end,
+            shifts the matches behind them and puts items (sorted, with
+            absolute positions after the edit) in their place.
+            Returns the removed matches. '''
+
+        self.move_gap(offset_start)
+
+        removed_items = list()
+        tail = self.tail
+        limit = self.text_length - offset_end
+        while len(tail) > 0 and tail[-1][0] >= limit:
+            distance_to_end, lines_to_end, kind, match = tail.pop()
+            removed_items.append((self.text_length - distance_to_end, self.number_of_lines - lines_to_end, kind, match))
+
+        self.text_length += length_difference
+        self.number_of_lines += line_difference
+        self.head += items
+        return removed_items
+
+    def iter_from(self, offset):
+        ''' Yields (offset, line, kind, match) for all matches at or
+            behind offset, in order. '''
+
+        head = self.head
+        for index in range(bisect.bisect_left(head, (offset,)), len(head)):
+            yield head[index]
+
+        text_length, number_of_lines, tail = self.text_length, self.number_of_lines, self.tail
+        for index in reversed(range(bisect.bisect_left(tail, (text_length - offset + 1,)))):
+            distance_to_end, lines_to_end, kind, match = tail[index]
+            yield (text_length - distance_to_end, number_of_lines - lines_to_end, kind, match)
+
+    def iter_reversed_before(self, offset):
+        ''' Yields (offset, line, kind, match) for all matches in front
+            of offset, last one first. '''
+
+        text_length, number_of_lines, tail = self.text_length, self.number_of_lines, self.tail
+        for index in range(bisect.bisect_left(tail, (text_length - offset + 1,)), len(tail)):
+            distance_to_end, lines_to_end, kind, match = tail[index]
+            yield (text_length - distance_to_end, number_of_lines - lines_to_end, kind, match)
+
+        head = self.head
+        for index in reversed(range(bisect.bisect_left(head, (offset,)))):
+            yield head[index]
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+
@@ -15,7 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
-from setzer.app.service_locator import ServiceLocator
+from setzer.document.parser.match_index import MatchIndex
+from setzer.helpers.bibtex_scanner import BibTeXScanner
 from setzer.helpers.observable import Observable
 from setzer.helpers.timer import timer
 
@@ -25,10 +26,13 @@ class ParserBibTeX(Observable):
     def __init__(self, document):
         Observable.__init__(self)
         self.document = document
-        self.text = ''
+        self.scanner = BibTeXScanner(['title'])
+        self.entries = MatchIndex()
+        self.bibitem_counts = dict()
 
         self.symbols = dict()
         self.symbols['bibitems'] = set()
+        self.symbols['bibitems_detailed'] = list()
         self.symbols['labels'] = set()
         self.symbols['labels_with_offset'] = list()
         self.symbols['todos'] = set()
@@ -44,23 +48,104 @@ class ParserBibTeX(Observable):
 
     #@timer
     def on_text_deleted(self, buffer, start_iter, end_iter):
-        start_offset = start_iter.get_offset()
-        end_offset = end_iter.get_offset()
-        self.text = self.text[:start_offset] + self.text[end_offset:]
-        self.parse_symbols(self.text)
+        line_difference = -buffer.get_text(start_iter, end_iter, True).count('\n')
+        self.update_entries(start_iter.get_offset(), end_iter.get_offset(), '', line_difference)
 
     #@timer
     def on_text_inserted(self, buffer, location_iter, text, text_length):
         offset = location_iter.get_offset()
-        self.text = self.text[:offset] + text + self.text[offset:]
-        self.parse_symbols(self.text)
+        self.update_entries(offset, offset, text, text.count('\n'))
 
     #@timer
-    def parse_symbols(self, text):
-        bibitems = set()
-        for match in ServiceLocator.get_regex_object(r'@(\w+)\{(\w+)').finditer(text):
-            bibitems = bibitems | {match.group(2).strip()}
+    def update_entries(self, offset_start, offset_end, text, line_difference):
+        ''' Called before the buffer changes. Scans the new text from
+            the end of the last closed entry in front of the edit, until
+            an entry starts where an old one did behind the edit. From
+            there on nothing changes, the old entries are only shifted. '''
 
-        self.symbols['bibitems'] = bibitems
+        buffer = self.document.source_buffer
+        char_count = buffer.get_char_count()
+        length_difference = len(text) - offset_end + offset_start
+        offset_edit_end = offset_start + len(text)
+
+        scan_start = 0
+        for offset, line, kind, entry in self.entries.iter_reversed_before(offset_start):
+            if entry['is_closed'] and offset + entry['length'] <= offset_start:
+                scan_start = offset + entry['length']
+                break
+        line = buffer.get_iter_at_offset(scan_start).get_line()
+
+        text = buffer.get_text(buffer.get_iter_at_offset(scan_start), buffer.get_iter_at_offset(offset_start), True) + text
+        text_end = offset_end
+        old_entries = self.entries.iter_from(offset_end)
+        old_entry = next(old_entries, None)
+        new_entries = list()
+        resync_offset = None
+        position = 0
+        line_position = 0
+        while resync_offset == None:
+            status, entry, position = self.scanner.scan_entry(text, position, text_end == char_count)
+            if status == 'more':
+                new_text_end = min(char_count, text_end + max(4096, text_end - offset_end))
+                text += buffer.get_text(buffer.get_iter_at_offset(text_end), buffer.get_iter_at_offset(new_text_end), True)
+                text_end = new_text_end
+            elif status == 'entry':
+                offset = scan_start + entry['start']
+                if offset >= offset_edit_end:
+                    while old_entry != None and old_entry[0] < offset - length_difference:
+                        old_entry = next(old_entries, None)
+                    if old_entry != None and old_entry[0] == offset - length_difference:
+                        resync_offset = old_entry[0]
+                        break
+
+                line += text.count('\n', line_position, entry['start'])
+                line_position = entry['start']
+                entry['length'] = entry['end'] - entry['start']
+                del(entry['start'])
+                del(entry['end'])
+                new_entries.append((offset, line, 'entry', entry))
+            else:
+                break
+
+        replace_end = resync_offset - 1 if resync_offset != None else char_count
+        removed_entries = self.entries.replace_range(scan_start, replace_end, length_difference, line_difference, new_entries)
+        self.update_bibitems(removed_entries, new_entries)
+        self.update_bibitems_detailed()
+
+    def update_bibitems(self, removed_entries, new_entries):
+        ''' Published symbols are replaced, not changed, so a new set is
+            made if keys come or go. '''
+
+        counts = self.bibitem_counts
+        removed_keys, added_keys = set(), set()
+        for offset, line, kind, entry in removed_entries:
+            key = entry['key']
+            if key != None:
+                counts[key] -= 1
+                if counts[key] == 0:
+                    del(counts[key])
+                    removed_keys.add(key)
+        for offset, line, kind, entry in new_entries:
+            key = entry['key']
+            if key != None:
+                if key in counts:
+                    counts[key] += 1
+                else:
+                    counts[key] = 1
+                    added_keys.add(key)
+
+        # a key that was only retyped stays in the set.
+        if removed_keys != added_keys:
+            self.symbols['bibitems'] = (self.symbols['bibitems'] - removed_keys) | added_keys
+
+    def update_bibitems_detailed(self):
+        ''' (key, type, offset, title) of all entries with a key, in
+            order, for the sidebar and autocomplete. A new list each
+            time, offsets behind an edit change with it. '''
+
+        self.symbols['bibitems_detailed'] = [(entry['key'], entry['type'], offset, entry['fields'].get('title', None)) for offset, line, kind, entry in self.entries if entry['key'] != None]
+
+    def is_up_to_date(self):
+        return True
 
 
@@ -15,35 +15,69 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
+import gi
+gi.require_version('Gtk', '4.0')
+from gi.repository import GObject
+
+import _thread as thread, queue
+
 from setzer.app.service_locator import ServiceLocator
+from setzer.document.parser.match_index import MatchIndex
 from setzer.helpers.observable import Observable
 from setzer.helpers.timer import timer
 
 
 class ParserLaTeX(Observable):
+    ''' Edits are collected on the main thread and handed to a worker
+        thread in batches, one per main loop iteration. The worker
+        updates its own state and publishes a copy of the symbols.
+        self.symbols is only replaced, never changed in place, and
+        always matches the buffer when finished_parsing is sent. '''
 
     def __init__(self, document):
         Observable.__init__(self)
         self.document = document
-        self.text_length = 0
-        self.number_of_lines = 0
-        self.block_symbol_matches = {'begin_or_end': list(), 'others': list()}
-        self.other_symbols = list()
 
         self.symbols = dict()
         self.symbols['bibitems'] = set()
         self.symbols['labels'] = set()
         self.symbols['labels_with_offset'] = list()
         self.symbols['todos'] = set()
-        self.symbols['todos_with_offset'] = set()
-        self.symbols['included_latex_files'] = set()
+        self.symbols['todos_with_offset'] = list()
+        self.symbols['included_latex_files'] = list()
         self.symbols['bibliographies'] = set()
         self.symbols['packages'] = set()
         self.symbols['packages_detailed'] = dict()
         self.symbols['blocks'] = list()
+        self.symbols_version = 0
 
         self.last_edit = None
 
+        # text ranges as (offset_start, offset_end_before, offset_end_after)
+        self.last_parsed_edit = None
+        self.pending_edit = None
+        self.pending_lines = None
+        self.pending_line_difference = 0
+        self.unpublished_edit = None
+        self.version = 0
+
+        # state of the worker thread, block and symbol matches
+        # are kept as (offset, line, kind, match)
+        self.text_length = 0
+        self.number_of_lines = 0
+        self.matches = MatchIndex()
+        self.blocks = list()
+        self.unmatched_begins = list()
+        self.begin_document = None
+        self.end_document = None
+        self.has_block_on_first_line = False
+        self.symbol_counts = {'labels': dict(), 'todos': dict(), 'bibliographies': dict(), 'packages': dict(), 'bibitems': dict()}
+        self.working_symbols = dict(self.symbols)
+        self.unposted_edit = None
+
+        self.parse_queue = queue.Queue()
+        thread.start_new_thread(self.parse_loop, ())
+
         self.document.source_buffer.connect('insert-text', self.on_insert_text)
         self.document.source_buffer.connect('delete-range', self.on_text_deleted)
 
@@ -62,52 +96,11 @@ class ParserLaTeX(Observable):
             after_iter.backward_char()
 
         text_length = offset_end - offset_start
-        text = buffer.get_text(start_iter, end_iter, True)
-        deleted_line_count = text.count('\n')
-        text_before = buffer.get_text(before_iter, start_iter, True)
-        text_after = buffer.get_text(end_iter, after_iter, True)
+        deleted_line_count = buffer.get_text(start_iter, end_iter, True).count('\n')
         offset_line_start = before_iter.get_offset()
-        self.text_length = char_count - offset_end + offset_start
-
-        block_symbol_matches = {'begin_or_end': list(), 'others': list()}
-        for match in self.block_symbol_matches['begin_or_end']:
-            if match[1] < line_start:
-                block_symbol_matches['begin_or_end'].append(match)
-        for match in self.block_symbol_matches['others']:
-            if match[1] < line_start:
-                block_symbol_matches['others'].append(match)
-        other_symbols = list()
-        for match in self.other_symbols:
-            if match[1] < offset_line_start:
-                other_symbols.append((match[0], match[1]))
-
-        offset_line_end = offset_end + len(text_after)
-        text = text_before + text_after
-
-        additional_matches = self.parse_for_blocks(text, line_start, offset_line_start)
-        block_symbol_matches['begin_or_end'] += additional_matches['begin_or_end']
-        block_symbol_matches['others'] += additional_matches['others']
-        for match in ServiceLocator.get_regex_object(r'\\(label|include|input|subfile|subimport|bibliography|addbibresource|todo)(?:\[[^\{\[]*\]){0,1}\{((?:\s|\w|\:|\.|,|\/|\\|\'|-|\"|\(|\))*)\}|\\(usepackage)(?:\[[^\{\[]*\]){0,1}\{((?:\s|\w|\:|,)*)\}|\\(bibitem)(?:\[.*\]){0,1}\{((?:\s|\w|\:)*)\}').finditer(text):
-            other_symbols.append((match, match.start() + offset_line_start))
+        offset_line_end = after_iter.get_offset()
 
-        for match in self.block_symbol_matches['begin_or_end']:
-            if match[1] > line_end:
-                block_symbol_matches['begin_or_end'].append((match[0], match[1] - deleted_line_count, match[2] - text_length))
-        for match in self.block_symbol_matches['others']:
-            if match[1] > line_end:
-                block_symbol_matches['others'].append((match[0], match[1] - deleted_line_count, match[2] - text_length))
-        for match in self.other_symbols:
-            if match[1] > offset_line_end:
-                other_symbols.append((match[0], match[1] - text_length))
-
-        self.block_symbol_matches = block_symbol_matches
-        self.number_of_lines = self.number_of_lines - deleted_line_count
-        self.parse_blocks()
-
-        self.other_symbols = other_symbols
-        self.parse_symbols()
-
-        self.add_change_code('finished_parsing')
+        self.add_edit((offset_start, offset_end, offset_start), (offset_line_start, offset_line_end, offset_line_end - text_length), -deleted_line_count)
 
     #@timer
     def on_insert_text(self, buffer, location_iter, text, text_length):
@@ -123,88 +116,197 @@ class ParserLaTeX(Observable):
         if not after_iter.get_offset() == char_count:
             after_iter.backward_char()
 
-        text_before = buffer.get_text(before_iter, location_iter, True)
         offset_line_start = before_iter.get_offset()
-        text_after = buffer.get_text(location_iter, after_iter, True)
-        offset_line_end = offset + len(text_after)
-        self.text_length = char_count + text_length
-        text_parse = text_before + text + text_after
-
-        block_symbol_matches = {'begin_or_end': list(), 'others': list()}
-        for match in self.block_symbol_matches['begin_or_end']:
-            if match[1] < line_start:
-                block_symbol_matches['begin_or_end'].append(match)
-        for match in self.block_symbol_matches['others']:
-            if match[1] < line_start:
-                block_symbol_matches['others'].append(match)
-        other_symbols = list()
-        for match in self.other_symbols:
-            if match[1] < offset_line_start:
-                other_symbols.append((match[0], match[1]))
-
-        additional_matches = self.parse_for_blocks(text_parse, line_start, offset_line_start)
-        block_symbol_matches['begin_or_end'] += additional_matches['begin_or_end']
-        block_symbol_matches['others'] += additional_matches['others']
-        for match in ServiceLocator.get_regex_object(r'\\(label|include|input|subfile|subimport|bibliography|addbibresource|todo)(?:\[[^\{\[]*\]){0,1}\{((?:\s|\w|\:|\.|,|\/|\\|\'|-|\"|\(|\))*)\}|\\(usepackage)(?:\[[^\{\[]*\]){0,1}\{((?:\s|\w|\:|,)*)\}|\\(bibitem)(?:\[.*\]){0,1}\{((?:\s|\w|\:)*)\}').finditer(text_parse):
-            other_symbols.append((match, match.start() + offset_line_start))
-
-        for match in self.block_symbol_matches['begin_or_end']:
-            if match[1] > line_start:
-                block_symbol_matches['begin_or_end'].append((match[0], match[1] + new_line_count, match[2] + text_length))
-        for match in self.block_symbol_matches['others']:
-            if match[1] > line_start:
-                block_symbol_matches['others'].append((match[0], match[1] + new_line_count, match[2] + text_length))
-        for match in self.other_symbols:
-            if match[1] > offset_line_end:
-                other_symbols.append((match[0], match[1] + text_length))
-
-        self.block_symbol_matches = block_symbol_matches
-        self.number_of_lines = self.number_of_lines + new_line_count
-        self.parse_blocks()
-
-        self.other_symbols = other_symbols
-        self.parse_symbols()
-
-        self.add_change_code('finished_parsing')
+        offset_line_end = after_iter.get_offset()
+
+        self.add_edit((offset, offset, offset + text_length), (offset_line_start, offset_line_end, offset_line_end + text_length), new_line_count)
+
+    def add_edit(self, edit, lines_edit, line_difference):
+        if self.pending_edit == None:
+            GObject.idle_add(self.submit_pending_edit)
+
+        self.pending_edit = self.compose_edits(self.pending_edit, edit)
+        self.pending_lines = self.compose_edits(self.pending_lines, lines_edit)
+        self.pending_line_difference += line_difference
+
+    def compose_edits(self, first, second):
+        ''' Combines two consecutive edits into one, covering the
+            text ranges changed by both. '''
+
+        if first == None: return second
+        if second == None: return first
+
+        start_1, end_before_1, end_after_1 = first
+        start_2, end_before_2, end_after_2 = second
+
+        if end_before_2 < start_1:
+            end_before = end_before_1
+        elif end_before_2 > end_after_1:
+            end_before = max(end_before_1, end_before_2 - end_after_1 + end_before_1)
+        else:
+            end_before = end_before_1
+
+        if end_after_1 < start_2:
+            end_after = end_after_2
+        elif end_after_1 > end_before_2:
+            end_after = max(end_after_2, end_after_1 + end_after_2 - end_before_2)
+        else:
+            end_after = end_after_2
+
+        return (min(start_1, start_2), end_before, end_after)
+
+    def submit_pending_edit(self):
+        if self.pending_edit == None: return False
+
+        buffer = self.document.source_buffer
+        offset_line_start, offset_line_end_before, offset_line_end = self.pending_lines
+        start_iter = buffer.get_iter_at_offset(offset_line_start)
+        end_iter = buffer.get_iter_at_offset(offset_line_end)
+
+        self.version += 1
+        job = dict()
+        job['version'] = self.version
+        job['text'] = buffer.get_text(start_iter, end_iter, True)
+        job['line_start'] = start_iter.get_line()
+        job['offset_line_start'] = offset_line_start
+        job['offset_line_end'] = offset_line_end_before
+        job['length_difference'] = offset_line_end - offset_line_end_before
+        job['line_difference'] = self.pending_line_difference
+        job['edit'] = self.pending_edit
+        self.parse_queue.put(job)
+
+        self.pending_edit = None
+        self.pending_lines = None
+        self.pending_line_difference = 0
+        return False
+
+    def parse_loop(self):
+        while True:
+            job = self.parse_queue.get()
+            self.update_range(job['text'], job['line_start'], job['offset_line_start'], job['offset_line_end'], job['length_difference'], job['line_difference'])
+            self.unposted_edit = self.compose_edits(self.unposted_edit, job['edit'])
+
+            # if there is more work already, skip publishing this state.
+            if self.parse_queue.empty():
+                GObject.idle_add(self.publish_symbols, job['version'], dict(self.working_symbols), self.unposted_edit)
+                self.unposted_edit = None
+
+    def publish_symbols(self, version, symbols, edit):
+        self.unpublished_edit = self.compose_edits(self.unpublished_edit, edit)
+
+        # symbols are only published if they match the buffer,
+        # otherwise the next result will come with the rest.
+        if version == self.version and self.pending_edit == None:
+            self.symbols = symbols
+            self.symbols_version = version
+            self.last_parsed_edit = self.unpublished_edit
+            self.unpublished_edit = None
+            self.add_change_code('finished_parsing')
+        return False
+
+    def is_up_to_date(self):
+        return self.symbols_version == self.version and self.pending_edit == None
+
+    def update_range(self, text, line_start, offset_line_start, offset_line_end, length_difference, line_difference):
+        ''' Replaces the matches of the edited lines (offset_line_start
+            to offset_line_end, before the edit) with the matches in
+            text, their new content. '''
+
+        new_items = self.parse_for_matches(text, line_start, offset_line_start)
+        removed_items = self.matches.replace_range(offset_line_start, offset_line_end, length_difference, line_difference, new_items)
+        self.text_length = self.matches.text_length
+        self.number_of_lines = self.matches.number_of_lines
+
+        # typing plain text is the common case, there the blocks
+        # and symbols behind the edit only have to be moved.
+        blocks_changed = any(item[2] != 'symbol' for item in removed_items) or any(item[2] != 'symbol' for item in new_items)
+        if blocks_changed or (line_start == 0 and line_difference != 0):
+            self.parse_blocks(line_start, offset_line_start)
+        else:
+            self.shift_blocks(offset_line_start, length_difference, line_difference)
+        self.parse_symbols(removed_items, new_items, offset_line_start, length_difference)
 
     #@timer
-    def parse_for_blocks(self, text, line_start, offset_line_start):
-        block_symbol_matches = {'begin_or_end': list(), 'others': list()}
+    def parse_for_matches(self, text, line_start, offset_line_start):
+        items = list()
+
         counter = line_start
         for match in ServiceLocator.get_regex_object(r'\n|\\(begin|end)\{((?:\w|•|\*)+)\}|\\(part|chapter|section|subsection|subsubsection|paragraph|subparagraph)(?:\*){0,1}\{([^\{]*)\}').finditer(text):
             if match.group(1) != None:
-                block_symbol_matches['begin_or_end'].append((match, counter, match.start() + offset_line_start))
+                items.append((match.start() + offset_line_start, counter, 'begin_or_end', match))
             elif match.group(3) != None:
-                block_symbol_matches['others'].append((match, counter, match.start() + offset_line_start))
+                items.append((match.start() + offset_line_start, counter, 'others', match))
                 counter += len(match.group(0).splitlines()) - 1
             if match.group(0) == '\n':
                 counter += 1
-        return block_symbol_matches
+
+        counter = line_start
+        last_position = 0
+        for match in ServiceLocator.get_regex_object(r'\\(label|include|input|subfile|subimport|bibliography|addbibresource|todo)(?:\[[^\{\[]*\]){0,1}\{((?:\s|\w|\:|\.|,|\/|\\|\'|-|\"|\(|\))*)\}|\\(usepackage)(?:\[[^\{\[]*\]){0,1}\{((?:\s|\w|\:|,)*)\}|\\(bibitem)(?:\[.*\]){0,1}\{((?:\s|\w|\:)*)\}').finditer(text):
+            counter += text.count('\n', last_position, match.start())
+            last_position = match.start()
+            items.append((match.start() + offset_line_start, counter, 'symbol', match))
+
+        items.sort(key=lambda item: item[0])
+        return items
 
     #@timer
-    def parse_blocks(self):
+    def parse_blocks(self, line_start, offset_line_start):
+        ''' Updates the blocks behind the edited line. Blocks closed
+            before it can't have changed, the state of the rest is
+            rebuilt from the blocks still open at that point. '''
+
+        # blocks starting in front of the edit are kept if they end before
+        # it; sections also need the line after them to be unchanged,
+        # because that's where the following section starts. sections
+        # ending at \end{document} are always updated, there might be
+        # another one behind the edit now.
+        kept_blocks = list()
+        reopened_begins = list()
+        sections = list()
+        for block in self.blocks:
+            if block[0] >= offset_line_start: break
+            if len(block) == 5:
+                if block[3] < line_start:
+                    kept_blocks.append(block)
+                else:
+                    reopened_begins.append((block[0], block[2], block[4]))
+            elif block[3] + 1 < line_start and (self.end_document == None or block[1] != self.end_document[0] - 1):
+                kept_blocks.append(block)
+            else:
+                sections.append((block[0], block[2], block[4], block[5]))
+        for begin in self.unmatched_begins:
+            if begin[0] >= offset_line_start: break
+            reopened_begins.append(begin)
+        reopened_begins.sort(key=lambda begin: begin[0])
+
         blocks = dict()
+        for offset, line_number, name in reopened_begins:
+            try: blocks[name].append([offset, None, line_number, None])
+            except KeyError: blocks[name] = [[offset, None, line_number, None]]
+
+        begin_document = self.get_last_document_command('begin', self.begin_document, offset_line_start)
+        end_document = self.get_last_document_command('end', self.end_document, offset_line_start)
+        if line_start == 0:
+            self.has_block_on_first_line = False
 
-        add_preamble_folding = True
-        end_document_offset = None
-        end_document_line = None
-        begin_document_offset = None
-        begin_document_line = None
         blocks_list = list()
-        for (match, line_number, offset) in self.block_symbol_matches['begin_or_end']:
+        for (offset, line_number, kind, match) in self.matches.iter_from(offset_line_start):
+            if kind == 'symbol': continue
+
             if line_number == 0:
-                add_preamble_folding = False
+                self.has_block_on_first_line = True
 
-            if match.group(1) == 'begin':
+            if kind == 'others':
+                sections.append((offset, line_number, match.group(3), match.group(4)))
+            elif match.group(1) == 'begin':
                 if match.group(2).strip() == 'document':
-                    begin_document_offset = offset
-                    begin_document_line = line_number
+                    begin_document = (offset, line_number)
                 try: blocks[match.group(2)].append([offset, None, line_number, None])
                 except KeyError: blocks[match.group(2)] = [[offset, None, line_number, None]]
             else:
                 if match.group(2).strip() == 'document':
-                    end_document_offset = offset
-                    end_document_line = line_number
+                    end_document = (offset, line_number)
                 try: blocks_begin = blocks[match.group(2)]
                 except KeyError: pass
                 else:
@@ -216,13 +318,18 @@ class ParserLaTeX(Observable):
                         block_begin.append(match.group(2))
                         blocks_list.append(block_begin)
 
+        unmatched_begins = list()
+        for name, begins in blocks.items():
+            for begin in begins:
+                unmatched_begins.append((begin[0], begin[2], name))
+        self.unmatched_begins = sorted(unmatched_begins, key=lambda begin: begin[0])
+        self.begin_document = begin_document
+        self.end_document = end_document
+
         relevant_following_blocks = [list(), list(), list(), list(), list(), list(), list()]
         levels = {'part': 0, 'chapter': 1, 'section': 2, 'subsection': 3, 'subsubsection': 4, 'paragraph': 5, 'subparagraph': 6}
-        for (match, line_number, offset) in reversed(self.block_symbol_matches['others']):
-            if line_number == 0:
-                add_preamble_folding = False
-
-            level = levels[match.group(3)]
+        for (offset, line_number, name, title) in reversed(sections):
+            level = levels[name]
             block = [offset, None, line_number, None]
 
             if len(relevant_following_blocks[level]) >= 1:
@@ -230,74 +337,180 @@ class ParserLaTeX(Observable):
                 block[1] = relevant_following_blocks[level][-1][0] - 1
                 block[3] = relevant_following_blocks[level][-1][2] - 1
             else:
-                if end_document_offset != None and block[0] < end_document_offset:
+                if end_document != None and block[0] < end_document[0]:
                     # - 1 to go one line up
-                    block[1] = end_document_offset - 1
-                    block[3] = end_document_line - 1
+                    block[1] = end_document[0] - 1
+                    block[3] = end_document[1] - 1
                 else:
                     block[1] = self.text_length
                     block[3] = self.number_of_lines
 
-            block.append(match.group(3))
-            block.append(match.group(4))
+            block.append(name)
+            block.append(title)
             blocks_list.append(block)
             for i in range(level, 7):
                 relevant_following_blocks[i].append(block)
 
-        if add_preamble_folding and begin_document_offset and begin_document_line:
-            blocks_list.append([0, begin_document_offset - 1, 0, begin_document_line - 1, 'preamble'])
+        # kept_blocks is sorted already, so this is a merge of two runs.
+        self.blocks = sorted(kept_blocks + blocks_list, key=lambda block: block[0])
+        self.update_blocks_symbol()
 
-        self.symbols['blocks'] = sorted(blocks_list, key=lambda block: block[0])
+    def shift_blocks(self, offset, length_difference, line_difference):
+        ''' Moves blocks behind offset after an edit without any
+            block commands in the edited lines. '''
+
+        blocks = list()
+        for block in self.blocks:
+            if block[1] < offset:
+                blocks.append(block)
+            else:
+                block = block.copy()
+                if block[0] >= offset:
+                    block[0] += length_difference
+                    block[2] += line_difference
+                block[1] += length_difference
+                block[3] += line_difference
+                blocks.append(block)
+        self.blocks = blocks
+
+        def shift(position):
+            if position != None and position[0] >= offset:
+                return (position[0] + length_difference, position[1] + line_difference) + position[2:]
+            return position
+
+        self.unmatched_begins = [shift(begin) for begin in self.unmatched_begins]
+        self.begin_document = shift(self.begin_document)
+        self.end_document = shift(self.end_document)
+        self.update_blocks_symbol()
+
+    def update_blocks_symbol(self):
+        begin_document = self.begin_document
+        if not self.has_block_on_first_line and begin_document != None and begin_document[0] and begin_document[1]:
+            self.working_symbols['blocks'] = [[0, begin_document[0] - 1, 0, begin_document[1] - 1, 'preamble']] + self.blocks
+        else:
+            self.working_symbols['blocks'] = self.blocks
+
+    def get_last_document_command(self, command, last_position, offset):
+        ''' Position of the last \\begin{document} or \\end{document} in
+            front of offset. If the last known one is still there, the
+            matches in between don't have to be looked at. '''
+
+        if last_position == None or last_position[0] < offset:
+            return last_position
+        for (match_offset, line_number, kind, match) in self.matches.iter_reversed_before(offset):
+            if kind == 'begin_or_end' and match.group(1) == command and match.group(2).strip() == 'document':
+                return (match_offset, line_number)
+        return None
 
     #@timer
-    def parse_symbols(self):
-        labels = set()
-        labels_with_offset = list()
-        todos = set()
-        todos_with_offset = list()
-        included_latex_files = list()
-        bibliographies = set()
-        bibitems = set()
-        packages = set()
+    def parse_symbols(self, removed_items, new_items, offset_line_start, length_difference):
+        ''' Updates the symbol sets by counting how often each value
+            occurs, so only the matches in the edited lines have to be
+            looked at. A set is only replaced if its members change. '''
+
+        changed_keys = set()
+        for (offset, line_number, kind, match) in removed_items:
+            if kind == 'symbol':
+                for key, value in self.get_symbol_values(match):
+                    counts = self.symbol_counts[key]
+                    counts[value] -= 1
+                    if counts[value] == 0:
+                        del(counts[value])
+                        changed_keys.add(key)
+        for (offset, line_number, kind, match) in new_items:
+            if kind == 'symbol':
+                for key, value in self.get_symbol_values(match):
+                    counts = self.symbol_counts[key]
+                    if value in counts:
+                        counts[value] += 1
+                    else:
+                        counts[value] = 1
+                        changed_keys.add(key)
+        for key in changed_keys:
+            self.working_symbols[key] = set(self.symbol_counts[key])
+
+        symbols_changed = any(item[2] == 'symbol' for item in removed_items) or any(item[2] == 'symbol' for item in new_items)
+        if symbols_changed:
+            self.parse_symbols_with_offset(offset_line_start)
+        elif self.has_symbols_behind(offset_line_start):
+            self.shift_symbols_with_offset(offset_line_start, length_difference)
+
+    def get_symbol_values(self, match):
+        if match.group(1) == 'label':
+            return [('labels', match.group(2).strip())]
+        elif match.group(1) == 'bibliography':
+            return [('bibliographies', entry.strip() + '.bib') for entry in match.group(2).strip().split(',')]
+        elif match.group(1) == 'addbibresource':
+            return [('bibliographies', entry.strip()) for entry in match.group(2).strip().split(',')]
+        elif match.group(1) == 'todo':
+            return [('todos', match.group(2).strip())]
+        elif match.group(3) == 'usepackage':
+            return [('packages', match.group(4).strip())]
+        elif match.group(5) == 'bibitem':
+            return [('bibitems', match.group(6).strip())]
+        return []
+
+    def has_symbols_behind(self, offset):
+        for key in ['labels_with_offset', 'todos_with_offset', 'included_latex_files']:
+            if len(self.working_symbols[key]) > 0 and self.working_symbols[key][-1][1] >= offset:
+                return True
+        for entries in self.working_symbols['packages_detailed'].values():
+            if entries[-1][0] >= offset:
+                return True
+        return False
+
+    def parse_symbols_with_offset(self, offset_line_start):
+        def get_prefix(entries):
+            index = len(entries)
+            while index > 0 and entries[index - 1][1] >= offset_line_start:
+                index -= 1
+            return entries[:index]
+
+        labels_with_offset = get_prefix(self.working_symbols['labels_with_offset'])
+        todos_with_offset = get_prefix(self.working_symbols['todos_with_offset'])
+        included_latex_files = get_prefix(self.working_symbols['included_latex_files'])
         packages_detailed = dict()
-        for match in self.other_symbols:
-            offset = match[1]
-            match = match[0]
+        for name, entries in self.working_symbols['packages_detailed'].items():
+            entries = [entry for entry in entries if entry[0] < offset_line_start]
+            if len(entries) > 0:
+                packages_detailed[name] = entries
+
+        for (offset, line_number, kind, match) in self.matches.iter_from(offset_line_start):
+            if kind != 'symbol': continue
+
             if match.group(1) == 'label':
-                labels = labels | {match.group(2).strip()}
                 labels_with_offset.append([match.group(2).strip(), offset])
             elif match.group(1) == 'include' or match.group(1) == 'input' or match.group(1) == 'subfile' or match.group(1) == 'subimport':
                 filename = match.group(2).strip()
                 if not filename.endswith('.tex'):
                     filename += '.tex'
                 included_latex_files.append((filename, offset))
-            elif match.group(1) == 'bibliography':
-                bibfiles = match.group(2).strip().split(',')
-                for entry in bibfiles:
-                    bibliographies = bibliographies | {entry.strip() + '.bib'}
-            elif match.group(1) == 'addbibresource':
-                bibfiles = match.group(2).strip().split(',')
-                for entry in bibfiles:
-                    bibliographies = bibliographies | {entry.strip()}
             elif match.group(1) == 'todo':
-                todos = todos | {match.group(2).strip()}
                 todos_with_offset.append([match.group(2).strip(), offset])
             elif match.group(3) == 'usepackage':
-                packages = packages | {match.group(4).strip()}
                 if match.group(4).strip() not in packages_detailed:
                     packages_detailed[match.group(4).strip()] = []
                 packages_detailed[match.group(4).strip()].append([offset, match])
-            elif match.group(5) == 'bibitem':
-                bibitems = bibitems | {match.group(6).strip()}
-
-        self.symbols['labels'] = labels
-        self.symbols['labels_with_offset'] = labels_with_offset
-        self.symbols['included_latex_files'] = included_latex_files
-        self.symbols['todos'] = todos
-        self.symbols['todos_with_offset'] = todos_with_offset
-        self.symbols['bibliographies'] = bibliographies
-        self.symbols['bibitems'] = bibitems
-        self.symbols['packages'] = packages
-        self.symbols['packages_detailed'] = packages_detailed
+
+        self.working_symbols['labels_with_offset'] = labels_with_offset
+        self.working_symbols['included_latex_files'] = included_latex_files
+        self.working_symbols['todos_with_offset'] = todos_with_offset
+        self.working_symbols['packages_detailed'] = packages_detailed
+
+    def shift_symbols_with_offset(self, offset, length_difference):
+        def shift(entries, entry_type):
+            index = len(entries)
+            while index > 0 and entries[index - 1][1] >= offset:
+                index -= 1
+            return entries[:index] + [entry_type((entry[0], entry[1] + length_difference)) for entry in entries[index:]]
+
+        self.working_symbols['labels_with_offset'] = shift(self.working_symbols['labels_with_offset'], list)
+        self.working_symbols['todos_with_offset'] = shift(self.working_symbols['todos_with_offset'], list)
+        self.working_symbols['included_latex_files'] = shift(self.working_symbols['included_latex_files'], tuple)
+
+        packages_detailed = dict()
+        for name, entries in self.working_symbols['packages_detailed'].items():
+            packages_detailed[name] = [[entry[0] + length_difference, entry[1]] if entry[0] >= offset else entry for entry in entries]
+        self.working_symbols['packages_detailed'] = packages_detailed
 
 
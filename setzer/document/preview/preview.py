@@ -48,6 +48,7 @@ class Preview(Observable):
         self.recolor_pdf = self.document.settings.get_value('preferences', 'recolor_pdf')
 
         self.poppler_document = None
+        self.page_sizes = list()
         self.page_width = None
         self.page_height = None
         self.layout = None
@@ -104,9 +105,12 @@ class Preview(Observable):
             self.reset_pdf_data()
             return
 
-        page_size = self.poppler_document.get_page(0).get_size()
-        self.page_width = page_size.width
-        self.page_height = page_size.height
+        self.page_sizes = list()
+        for page_number in range(self.poppler_document.get_n_pages()):
+            page_size = self.poppler_document.get_page(page_number).get_size()
+            self.page_sizes.append((page_size.width, page_size.height))
+        self.page_width = max(width for width, height in self.page_sizes)
+        self.page_height = max(height for width, height in self.page_sizes)
         self.update_vertical_margin()
         self.layout = None
         self.add_change_code('pdf_changed')
@@ -115,6 +119,7 @@ class Preview(Observable):
     def reset_pdf_data(self):
         self.pdf_filename = None
         self.poppler_document = None
+        self.page_sizes = list()
         self.page_width = None
         self.page_height = None
         self.layout = None
@@ -148,12 +153,12 @@ class Preview(Observable):
     def scroll_dest_on_screen(self, dest):
         if self.layout == None: return
 
-        page_number = dest.page_num
+        page_number = min(max(dest.page_num - 1, 0), len(self.page_sizes) - 1)
         content = self.view.content
         left = dest.left * self.layout.scale_factor
         top = dest.top * self.layout.scale_factor
         x = max(min(left, content.scrolling_offset_x), content.scrolling_offset_x + content.width)
-        y = (self.layout.page_height + self.layout.page_gap) * (page_number) - top - self.layout.page_gap
+        y = self.layout.get_page_offset(page_number) + self.layout.get_page_size(page_number)[1] - top
 
         self.view.content.scroll_to_position([x, y])
 
@@ -180,7 +185,7 @@ class Preview(Observable):
             height = position['height'] * self.layout.scale_factor
 
             x = max(min(left - 18, content.scrolling_offset_x), left + width - content.width + 18)
-            y = (self.layout.page_height + self.layout.page_gap) * (page_number - 1) + max(0, top - height / 2 - content.height * 0.3)
+            y = self.layout.get_page_offset(page_number - 1) + max(0, top - height / 2 - content.height * 0.3)
 
             content.scroll_to_position([x, y])
             self.presenter.start_fade_loop()
@@ -189,20 +194,23 @@ class Preview(Observable):
         if self.layout == None: return False
 
         window_width = self.view.get_allocated_width()
-        y_total_pixels = min(max(y_offset, 0), (self.layout.page_height + self.layout.page_gap) * self.poppler_document.get_n_pages() - self.layout.page_gap)
-        x_pixels = min(max(x_offset - self.layout.get_horizontal_margin(window_width), 0), self.layout.page_width)
-        page = math.floor(y_total_pixels / (self.layout.page_height + self.layout.page_gap))
-        y_pixels = min(max(y_total_pixels - page * (self.layout.page_height + self.layout.page_gap), 0), self.layout.page_height)
+        y_total_pixels = min(max(y_offset, 0), self.layout.canvas_height)
+        page = self.layout.get_page_number_by_offset(y_total_pixels)
+        page_width, page_height = self.layout.get_page_size(page)
+        x_pixels = min(max(x_offset - self.layout.get_horizontal_margin(window_width, page), 0), page_width)
+        y_pixels = min(max(y_total_pixels - self.layout.get_page_offset(page), 0), page_height)
         x = x_pixels / self.layout.scale_factor
         y = y_pixels / self.layout.scale_factor
+
+        poppler_page = self.poppler_document.get_page(page)
+        page_width, page_height = self.page_sizes[page]
         page += 1
 
-        poppler_page = self.poppler_document.get_page(page - 1)
         rect = Poppler.Rectangle()
-        rect.x1 = max(min(x, self.page_width), 0)
-        rect.y1 = max(min(y, self.page_height), 0)
-        rect.x2 = max(min(x, self.page_width), 0)
-        rect.y2 = max(min(y, self.page_height), 0)
+        rect.x1 = max(min(x, page_width), 0)
+        rect.y1 = max(min(y, page_height), 0)
+        rect.x2 = max(min(x, page_width), 0)
+        rect.y2 = max(min(y, page_height), 0)
         word = poppler_page.get_selected_text(Poppler.SelectionStyle.WORD, rect)
         context = poppler_page.get_selected_text(Poppler.SelectionStyle.LINE, rect)
         self.document.build_system.backward_sync(page, x, y, word, context)
@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
+import bisect
+
 from setzer.helpers.observable import Observable
 
 
@@ -35,8 +37,16 @@ class PreviewLayouter(Observable):
             layout.page_height = layout.scale_factor * self.preview.page_height
             layout.page_gap = layout.hidpi_factor * 10
             layout.border_width = 1
+
+            offset = 0
+            for width, height in self.preview.page_sizes:
+                layout.page_sizes.append((layout.scale_factor * width, layout.scale_factor * height))
+                layout.page_offsets.append(offset)
+                offset += layout.scale_factor * height + layout.page_gap
+            layout.page_offsets.append(offset)
+
             layout.canvas_width = layout.page_width + 2 * layout.get_horizontal_margin(window_width)
-            layout.canvas_height = self.preview.poppler_document.get_n_pages() * (layout.page_height + layout.page_gap) - layout.page_gap
+            layout.canvas_height = offset - layout.page_gap
             self.update_synctex_rectangles(layout)
             return layout
         else:
@@ -58,11 +68,17 @@ class PreviewLayouter(Observable):
 
 
 class PreviewLayout(object):
+    ''' Pages can differ in size. page_width and page_height are those
+        of the largest page, page_offsets holds the top of each page
+        followed by the end of the canvas (plus one page gap), so pages
+        are looked up by bisection. '''
 
     def __init__(self, hidpi_factor):
         self.hidpi_factor = hidpi_factor
         self.page_width = None
         self.page_height = None
+        self.page_sizes = list()
+        self.page_offsets = list()
         self.page_gap = None
         self.border_width = None
         self.canvas_width = None
@@ -70,20 +86,37 @@ class PreviewLayout(object):
         self.scale_factor = None
         self.visible_synctex_rectangles = dict()
 
-    def get_horizontal_margin(self, window_width):
-        return int(max((window_width - self.page_width) / 2, 0))
+    def get_horizontal_margin(self, window_width, page_number=None):
+        margin = int(max((window_width - self.page_width) / 2, 0))
+        if page_number != None:
+            margin += int((self.page_width - self.page_sizes[page_number][0]) / 2)
+        return margin
+
+    def get_page_size(self, page_number):
+        return self.page_sizes[page_number]
+
+    def get_page_offset(self, page_number):
+        return self.page_offsets[page_number]
 
     def get_page_number_and_offsets_by_document_offsets(self, x, y, window_width):
-        if y % (self.page_height + self.page_gap) > self.page_height: return None
-        if x < self.get_horizontal_margin(window_width) or x > (self.get_horizontal_margin(window_width) + self.page_width): return None
+        page_number = self.get_page_number_by_offset(y)
+        page_width, page_height = self.page_sizes[page_number]
+        margin = self.get_horizontal_margin(window_width, page_number)
+
+        if y - self.page_offsets[page_number] > page_height: return None
+        if x < margin or x > margin + page_width: return None
 
-        page_number = int(y // (self.page_height + self.page_gap))
-        y_offset = y % (self.page_height + self.page_gap) / self.scale_factor
-        x_offset = (x - self.get_horizontal_margin(window_width)) / self.scale_factor
+        y_offset = (y - self.page_offsets[page_number]) / self.scale_factor
+        x_offset = (x - margin) / self.scale_factor
 
         return (page_number, x_offset, y_offset)
 
+    def get_page_number_by_offset(self, offset):
+        ''' Returns the page at offset, the gap below a page belongs to it. '''
+
+        return min(max(bisect.bisect_right(self.page_offsets, offset) - 1, 0), len(self.page_sizes) - 1)
+
     def get_page_by_offset(self, offset):
-        return int(1 + offset // (self.page_height + self.page_gap))
+        return self.get_page_number_by_offset(offset) + 1
 
 
@@ -19,43 +19,103 @@ import gi
 gi.require_version('Poppler', '0.18')
 from gi.repository import Poppler
 
+import math
+from collections import OrderedDict
+
 from setzer.helpers.observable import Observable
-from setzer.helpers.timer import timer
 
 
 class PreviewLinksParser(Observable):
+    ''' Keeps a PreviewLinkIndex for each page. The indexes are built by
+        the page renderer's workers together with the page fingerprints,
+        for the visible pages first, and are stored by fingerprint, so
+        pages that didn't change keep their index when the pdf reloads.
+
+        Named destinations are looked up when a link is hit. '''
 
     def __init__(self, preview):
         Observable.__init__(self)
         self.preview = preview
-        self.links = dict()
-
-        self.preview.connect('pdf_changed', self.on_pdf_changed)
-
-    def on_pdf_changed(self, notifying_object):
-        if self.preview.poppler_document != None:
-            self.links = dict()
-            for page_num in range(self.preview.poppler_document.get_n_pages()):
-                self.links[page_num] = None
-        else:
-            self.links = dict()
-
-    def get_links_for_page(self, page_number):
-        if page_number in self.links:
-            if self.links[page_number] == None:
-                links = list()
-                link_mapping_list = self.preview.poppler_document.get_page(page_number).get_link_mapping()
-                for link_mapping in link_mapping_list:
-                    action = link_mapping.action
-                    area = link_mapping.area
-                    if action.type == Poppler.ActionType.URI:
-                        links.append([area, action.uri.uri, 'uri'])
-                    elif action.type == Poppler.ActionType.GOTO_DEST:
-                        dest = self.preview.poppler_document.find_dest(action.goto_dest.dest.named_dest)
-                        links.append([area, dest, 'goto'])
-                self.links[page_number] = links
-            return self.links[page_number]
-        else:
-            return list()
+        self.maximum_number_of_indexes = 2000
+        self.link_indexes = OrderedDict()
+
+        self.preview.page_renderer.connect('page_analyzed', self.on_page_analyzed)
+
+    def on_page_analyzed(self, page_renderer, parameter):
+        page_number, fingerprint, link_index = parameter
+
+        if fingerprint not in self.link_indexes:
+            self.link_indexes[fingerprint] = link_index
+            if len(self.link_indexes) > self.maximum_number_of_indexes:
+                self.link_indexes.popitem(last=False)
+        self.link_indexes.move_to_end(fingerprint)
+
+    def get_link_at_position(self, page_number, x, y):
+        ''' Returns (area, target, type) for the link at x, y in pdf
+            coordinates, or None. type is 'uri' or 'goto', target is
+            an uri or a Poppler.Dest. '''
+
+        fingerprint = self.preview.page_renderer.fingerprints.get(page_number)
+        if fingerprint not in self.link_indexes: return None
+
+        link = self.link_indexes[fingerprint].get_link_at_position(x, y)
+        if link == None: return None
+
+        area, target, link_type = link
+        if link_type == 'goto' and isinstance(target, str):
+            target = self.preview.poppler_document.find_dest(target)
+            if target == None: return None
+        return (area, target, link_type)
+
+
+class PreviewLinkIndex():
+    ''' The links of a page in a grid of cell_size points. Each cell
+        lists the links overlapping it, so hit testing only looks at
+        the links in one cell. '''
+
+    def __init__(self, page, cell_size=32):
+        self.cell_size = cell_size
+        self.links = list()
+        self.cells = dict()
+
+        for link_mapping in page.get_link_mapping():
+            action = link_mapping.action
+            area = link_mapping.area
+            if action.type == Poppler.ActionType.URI:
+                self.links.append((area, action.uri.uri, 'uri'))
+            elif action.type == Poppler.ActionType.GOTO_DEST:
+                dest = action.goto_dest.dest
+                if dest.type == Poppler.DestType.NAMED:
+                    self.links.append((area, dest.named_dest, 'goto'))
+                else:
+                    self.links.append((area, dest, 'goto'))
+
+        for index, link in enumerate(self.links):
+            area = link[0]
+            for column in range(math.floor(min(area.x1, area.x2) / cell_size), math.floor(max(area.x1, area.x2) / cell_size) + 1):
+                for row in range(math.floor(min(area.y1, area.y2) / cell_size), math.floor(max(area.y1, area.y2) / cell_size) + 1):
+                    try:
+                        self.cells[(column, row)].append(index)
+                    except KeyError:
+                        self.cells[(column, row)] = [index]
+
+    def get_link_at_position(self, x, y):
+        cell = (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+        for index in self.cells.get(cell, list()):
+            area = self.links[index][0]
+            if x > area.x1 and x < area.x2 and y > area.y1 and y < area.y2:
+                return self.links[index]
+        return None
+
+    def get_fingerprint_data(self):
+        ''' Returns the links as bytes, to be hashed into the page
+            fingerprint. '''
+
+        data = list()
+        for area, target, link_type in self.links:
+            if link_type == 'goto' and not isinstance(target, str):
+                target = (target.page_num, target.left, target.top)
+            data.append((area.x1, area.y1, area.x2, area.y2, link_type, target))
+        return repr(data).encode('utf-8', 'surrogatepass')
 
 
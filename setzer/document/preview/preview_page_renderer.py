@@ -17,32 +17,55 @@
 
 import gi
 gi.require_version('Gtk', '4.0')
-from gi.repository import GObject, Gdk
+gi.require_version('Poppler', '0.18')
+from gi.repository import GObject, GLib, Gdk, Poppler
 import cairo
 
 import _thread as thread, queue
-import time
+import hashlib
+import itertools
+import array
 import math
-import numpy as np
-from PIL import Image, ImageFilter
+import os
 
 from setzer.app.color_manager import ColorManager
 from setzer.helpers.observable import Observable
+from setzer.helpers.surface_recolor import SurfaceRecolor
+from setzer.document.preview.preview_surface_cache import PreviewSurfaceCache
+from setzer.document.preview.preview_links_parser import PreviewLinkIndex
 
 
 class PreviewPageRenderer(Observable):
+    ''' Rasterizes pages in tiles of tile_size device pixels on a pool
+        of worker threads. Each worker opens its own Poppler document,
+        so tiles of the same page render in parallel.
+
+        Rendered tiles go to the PreviewSurfaceCache. Tiles in the
+        viewport are queued first, then the rest of the visible pages,
+        then the pages around them.
+
+        Tiles are cached by a fingerprint of the page content, which the
+        workers compute before a page of a new pdf file is rendered.
+        They also build the link index of the page at that point.
+        Pages that didn't change in a build keep their tiles, until
+        a fingerprint is known the page is drawn from the previous pdf. '''
 
     def __init__(self, preview):
         Observable.__init__(self)
         self.preview = preview
         self.maximum_rendered_pixels = 20000000
+        self.tile_size = 512
+        self.number_of_workers = max(min((os.cpu_count() or 1) - 1, 4), 1)
 
-        self.visible_pages_lock = thread.allocate_lock()
         self.visible_pages = list()
-        self.page_width = None
+        self.visible_pages_additional = list()
+        self.layout = None
+        self.pdf_filename = None
         self.pdf_date = None
-        self.rendered_pages = dict()
-        self.is_active_lock = thread.allocate_lock()
+        self.color = None
+        self.fingerprints = dict()
+        self.previous_fingerprints = dict()
+        self.fingerprint_scale = 0.5
         self.is_active = False
 
         self.preview.connect('position_changed', self.on_layout_or_position_changed)
@@ -50,19 +73,19 @@ class PreviewPageRenderer(Observable):
         self.preview.connect('recolor_pdf_changed', self.on_recolor_pdf_changed)
         self.preview.document.settings.connect('settings_changed', self.on_settings_changed)
 
-        self.page_render_count_lock = thread.allocate_lock()
-        self.page_render_count = dict()
-        self.render_queue = queue.Queue()
-        self.render_queue_low_priority = queue.Queue()
-        self.rendered_pages_queue = queue.Queue()
-        thread.start_new_thread(self.render_page_loop, ())
-        GObject.timeout_add(50, self.rendered_pages_loop)
+        self.tiles_lock = thread.allocate_lock()
+        self.queued_tiles = dict()
+        self.tiles_in_progress = set()
+        self.task_count = itertools.count()
+        self.render_queue = queue.PriorityQueue()
+        self.rendered_tiles_queue = queue.Queue()
+        self.rendered_tiles_scheduled = False
+        for i in range(self.number_of_workers):
+            thread.start_new_thread(self.render_tile_loop, ())
 
     def on_layout_or_position_changed(self, notifying_object):
         if self.preview.layout != None:
             self.update_rendered_pages()
-        else:
-            self.rendered_pages = dict()
 
     def on_recolor_pdf_changed(self, preview):
         self.update_rendered_pages()
@@ -74,164 +97,290 @@ class PreviewPageRenderer(Observable):
             self.update_rendered_pages()
 
     def activate(self):
-        with self.is_active_lock:
-            self.is_active = True
+        self.is_active = True
+        self.process_rendered_tiles()
         self.update_rendered_pages()
 
     def deactivate(self):
-        with self.is_active_lock:
-            self.is_active = False
-        self.rendered_pages = dict()
-        with self.visible_pages_lock:
-            self.visible_pages = list()
-        self.page_width = None
+        self.is_active = False
+        with self.tiles_lock:
+            self.queued_tiles = dict()
+        self.visible_pages = list()
+        self.visible_pages_additional = list()
+        self.layout = None
         self.pdf_date = None
 
-    def render_page_loop(self):
+    def render_tile_loop(self):
+        poppler_document = None
+        document_key = None
+        recolor = SurfaceRecolor()
+
         while True:
-            with self.is_active_lock:
-                is_active = self.is_active
-            todo = None
-            if is_active:
-                try: todo = self.render_queue.get(block=False)
-                except queue.Empty:
-                    try: todo = self.render_queue_low_priority.get(block=False)
-                    except queue.Empty:
-                        todo = None
-            if todo != None:
-                with self.page_render_count_lock:
-                    render_count = self.page_render_count[todo['page_number']]
-                with self.visible_pages_lock:
-                    is_visible = (todo['page_number'] >= self.visible_pages_additional[0] and todo['page_number'] <= self.visible_pages_additional[1])
-                if todo['render_count'] == render_count and is_visible:
-                    colors = todo['matching_theme_colors']
-                    width = todo['page_width'] * todo['hidpi_factor']
-                    height = todo['page_height'] * 2
-                    surface = cairo.ImageSurface(cairo.Format.ARGB32, width, height)
-                    ctx = cairo.Context(surface)
-
-                    ctx.set_source_rgba(1, 1, 1, 1)
-                    ctx.rectangle(0, 0, width, height)
-                    ctx.fill()
-
-                    ctx.scale(todo['scale_factor'] * todo['hidpi_factor'], todo['scale_factor'] * todo['hidpi_factor'])
-                    page = self.preview.poppler_document.get_page(todo['page_number'])
-                    page.render(ctx)
-
-                    if colors != None:
-                        pil_img = Image.frombuffer("RGBA", (width, height), surface.get_data(), "raw", "RGBA", 0, 1)
-
-                        img_data = np.array(pil_img, dtype=np.ubyte)
-                        alpha = 255 - 0.3 * img_data[..., 0] - 0.6 * img_data[..., 1] - 0.1 * img_data[..., 2]
-                        img_data[:,:,-1] = alpha
-                        pil_img = Image.fromarray(np.ubyte(img_data))
-
-                        im_bytes = bytearray(pil_img.tobytes('raw', 'BGRa'))
-                        surface = cairo.ImageSurface.create_for_data(im_bytes, cairo.FORMAT_ARGB32, width, height)
-                        temp_ctx = cairo.Context(surface)
-
-                        Gdk.cairo_set_source_rgba(temp_ctx, colors[0])
-                        temp_ctx.set_operator(cairo.Operator.IN)
-                        temp_ctx.rectangle(0, 0, width, height)
-                        temp_ctx.fill()
-
-                    self.rendered_pages_queue.put({'page_number': todo['page_number'], 'item': [surface, todo['page_width'], todo['pdf_date'], colors]})
-            else:
-                time.sleep(0.05)
+            priority, count, task = self.render_queue.get()
+            with self.tiles_lock:
+                if self.queued_tiles.get(task['key']) != priority: continue
+                del(self.queued_tiles[task['key']])
+                self.tiles_in_progress.add(task['key'])
 
-    def rendered_pages_loop(self):
-        with self.is_active_lock:
-            is_active = self.is_active
-        if not is_active: return True
+            if (task['pdf_filename'], task['pdf_date']) != document_key:
+                try:
+                    poppler_document = Poppler.Document.new_from_file(GLib.filename_to_uri(task['pdf_filename']))
+                except Exception:
+                    poppler_document = None
+                document_key = (task['pdf_filename'], task['pdf_date'])
+
+            result = None
+            if poppler_document != None and task['page_number'] < poppler_document.get_n_pages():
+                if task['type'] == 'fingerprint':
+                    page = poppler_document.get_page(task['page_number'])
+                    link_index = PreviewLinkIndex(page)
+                    result = (self.get_fingerprint(page, link_index), link_index)
+                else:
+                    result = self.render_tile(poppler_document, task, recolor)
+            self.rendered_tiles_queue.put({'type': task['type'], 'key': task['key'], 'result': result})
+            self.schedule_processing()
+
+    def schedule_processing(self):
+        ''' Wakes the main loop for tiles that are done, once for all
+            tiles that come in before it gets to them. '''
+
+        with self.tiles_lock:
+            if self.rendered_tiles_scheduled: return
+            self.rendered_tiles_scheduled = True
+        GObject.idle_add(self.process_rendered_tiles)
+
+    def get_fingerprint(self, page, link_index):
+        ''' Hashes page size, text, text layout, image positions and
+            links, plus a low resolution rendering for changes in
+            graphics. '''
+
+        fingerprint = hashlib.sha1()
+        width, height = page.get_size()
+        fingerprint.update(array.array('d', (width, height)).tobytes())
+        fingerprint.update(page.get_text().encode('utf-8', 'surrogatepass'))
+        success, rectangles = page.get_text_layout()
+        if success:
+            fingerprint.update(array.array('d', (value for rectangle in rectangles for value in (rectangle.x1, rectangle.y1, rectangle.x2, rectangle.y2))).tobytes())
+        for mapping in page.get_image_mapping():
+            fingerprint.update(array.array('d', (mapping.image_id, mapping.area.x1, mapping.area.y1, mapping.area.x2, mapping.area.y2)).tobytes())
+        fingerprint.update(link_index.get_fingerprint_data())
+
+        surface = cairo.ImageSurface(cairo.Format.ARGB32, math.ceil(width * self.fingerprint_scale), math.ceil(height * self.fingerprint_scale))
+        ctx = cairo.Context(surface)
+        ctx.scale(self.fingerprint_scale, self.fingerprint_scale)
+        page.render(ctx)
+        surface.flush()
+        fingerprint.update(surface.get_data())
+        return fingerprint.hexdigest()
+
+    def render_tile(self, poppler_document, task, recolor):
+        x, y, width, height = task['rectangle']
+        surface = cairo.ImageSurface(cairo.Format.ARGB32, width, height)
+        ctx = cairo.Context(surface)
+
+        ctx.set_source_rgba(1, 1, 1, 1)
+        ctx.rectangle(0, 0, width, height)
+        ctx.fill()
+
+        ctx.translate(-x, -y)
+        ctx.scale(task['scale_factor'] * task['hidpi_factor'], task['scale_factor'] * task['hidpi_factor'])
+        page = poppler_document.get_page(task['page_number'])
+        page.render(ctx)
+
+        if task['color'] != None:
+            recolor.recolor(surface, task['color'])
+        return surface
+
+    def process_rendered_tiles(self):
+        with self.tiles_lock:
+            self.rendered_tiles_scheduled = False
+        if not self.is_active: return False
 
         changed = False
-        while self.rendered_pages_queue.empty() == False:
-            try: todo = self.rendered_pages_queue.get(block=False)
+        fingerprints_changed = False
+        while self.rendered_tiles_queue.empty() == False:
+            try: todo = self.rendered_tiles_queue.get(block=False)
             except queue.Empty: pass
             else:
-                try:
-                    del(self.rendered_pages[todo['page_number']])
-                except KeyError: pass
-                self.rendered_pages[todo['page_number']] = todo['item']
-                changed = True
+                with self.tiles_lock:
+                    self.tiles_in_progress.discard(todo['key'])
+                if todo['result'] == None: continue
+
+                if todo['type'] == 'fingerprint':
+                    pdf_filename, pdf_date, page_number = todo['key'][1:]
+                    if pdf_filename != self.pdf_filename or pdf_date != self.pdf_date: continue
+
+                    fingerprint, link_index = todo['result']
+                    self.fingerprints[page_number] = fingerprint
+                    self.add_change_code('page_analyzed', (page_number, fingerprint, link_index))
+                    fingerprints_changed = True
+                else:
+                    PreviewSurfaceCache.add(todo['key'], todo['result'])
+                    changed = True
+        if fingerprints_changed:
+            self.update_rendered_pages()
+            changed = True
         if changed:
             self.add_change_code('rendered_pages_changed')
-        return True
+        return False
+
+    def get_page_key(self, page_number, allow_previous=False):
+        ''' Returns None if the page has no fingerprint yet. With
+            allow_previous, the page of the previous pdf is used then. '''
+
+        if page_number in self.fingerprints:
+            return (self.fingerprints[page_number], self.color)
+        elif allow_previous and page_number in self.previous_fingerprints:
+            return (self.previous_fingerprints[page_number], self.color)
+        return None
+
+    def get_page_size(self, page_number):
+        ''' Returns the size of a rendered page in device pixels. '''
+
+        layout = self.preview.layout
+        page_width, page_height = layout.get_page_size(page_number)
+        return (int(page_width) * layout.hidpi_factor, int(page_height) * layout.hidpi_factor)
+
+    def get_tiles(self, page_number):
+        ''' Yields (tile_x, tile_y, x, y, width, height) for the tiles of
+            a page at the current size, in device pixels. '''
+
+        page_width, page_height = self.get_page_size(page_number)
+        for tile_y in range(math.ceil(page_height / self.tile_size)):
+            for tile_x in range(math.ceil(page_width / self.tile_size)):
+                x, y = tile_x * self.tile_size, tile_y * self.tile_size
+                yield (tile_x, tile_y, x, y, min(self.tile_size, page_width - x), min(self.tile_size, page_height - y))
+
+    def get_rendered_tiles(self, page_number):
+        ''' Returns a list of (width, tiles) to draw a page, where width
+            is the page width the tiles were rendered at and tiles are
+            (x, y, surface) in device pixels of that size.
+
+            Tiles at the current size come first. If some of them are
+            missing, tiles at the closest other size in the cache follow,
+            to be drawn scaled in the gaps. '''
+
+        if self.layout == None: return list()
+
+        page_key = self.get_page_key(page_number, allow_previous=True)
+        if page_key == None: return list()
+
+        page_width, page_height = self.get_page_size(page_number)
+        tiles_by_width = PreviewSurfaceCache.get_tiles_by_width(page_key)
+        tiles = tiles_by_width.get(page_width, set())
+
+        widths = list()
+        if len(tiles) > 0:
+            widths.append(page_width)
+        if len(tiles) < math.ceil(page_width / self.tile_size) * math.ceil(page_height / self.tile_size):
+            other_widths = [width for width in tiles_by_width if width != page_width]
+            if len(other_widths) > 0:
+                widths.append(min(other_widths, key=lambda width: (width < page_width, abs(width - page_width))))
+
+        rendered_tiles = list()
+        for width in widths:
+            surfaces = list()
+            for tile_x, tile_y in list(tiles_by_width[width]):
+                surface = PreviewSurfaceCache.get((page_key, width, tile_x, tile_y))
+                surfaces.append((tile_x * self.tile_size, tile_y * self.tile_size, surface))
+            rendered_tiles.append((width, surfaces))
+        return rendered_tiles
 
     def update_rendered_pages(self):
-        with self.is_active_lock:
-            is_active = self.is_active
-        if not is_active: return
+        if not self.is_active: return
         if self.preview.layout == None: return
 
-        hidpi_factor = self.preview.layout.hidpi_factor
-        page_width = int(self.preview.layout.page_width)
-        page_height = int(self.preview.layout.page_height)
+        layout = self.preview.layout
+        hidpi_factor = layout.hidpi_factor
+        page_width = int(layout.page_width)
+        page_height = int(layout.page_height)
+        number_of_pages = len(layout.page_sizes)
 
         offset = self.preview.view.content.scrolling_offset_y
-        current_page = self.preview.layout.get_page_by_offset(offset) - 1
+        view_width = self.preview.view.get_allocated_width()
+        view_height = self.preview.view.get_allocated_height()
 
-        visible_pages = [current_page, min(current_page + math.floor(self.preview.view.get_allocated_height() / page_height) + 1, self.preview.poppler_document.get_n_pages() - 1)]
+        visible_pages = [layout.get_page_number_by_offset(offset), layout.get_page_number_by_offset(offset + view_height)]
 
         max_additional_pages = max(math.floor(self.maximum_rendered_pixels / (page_width * page_height * hidpi_factor * hidpi_factor) - visible_pages[1] + visible_pages[0]), 0)
-        visible_pages_additional = [max(int(visible_pages[0] - max_additional_pages / 2), 0), min(int(visible_pages[1] + max_additional_pages / 2), self.preview.poppler_document.get_n_pages() - 1)]
-
-        pdf_date = self.preview.get_pdf_date()
-        with self.visible_pages_lock:
-            self.visible_pages = visible_pages
-            self.visible_pages_additional = visible_pages_additional
-        self.page_width = page_width
-        self.pdf_date = pdf_date
+        visible_pages_additional = [max(int(visible_pages[0] - max_additional_pages / 2), 0), min(int(visible_pages[1] + max_additional_pages / 2), number_of_pages - 1)]
 
         if self.preview.recolor_pdf:
-            colors = (ColorManager.get_ui_color('view_fg_color'), ColorManager.get_ui_color('view_bg_color'))
+            color = ColorManager.get_ui_color('view_fg_color')
+            color = (color.red, color.green, color.blue, color.alpha)
         else:
-            colors = None
+            color = None
 
-        changed = False
-        for page_number in list(self.rendered_pages):
-            if self.rendered_pages[page_number][3] == None and colors == None:
-                colors_changed = False
-            elif self.rendered_pages[page_number][3] == None and colors != None:
-                colors_changed = True
-            elif self.rendered_pages[page_number][3] != None and colors == None:
-                colors_changed = True
-            elif not self.rendered_pages[page_number][3][0].equal(colors[0]):
-                colors_changed = True
-            elif not self.rendered_pages[page_number][3][1].equal(colors[1]):
-                colors_changed = True
-            else:
-                colors_changed = False
-
-            if self.rendered_pages[page_number][2] != pdf_date or colors_changed or page_number < visible_pages_additional[0] or page_number > visible_pages_additional[1]:
-                del(self.rendered_pages[page_number])
-                changed = True
+        pdf_filename = self.preview.pdf_filename
+        pdf_date = self.preview.get_pdf_date()
+        # fingerprints only depend on page content, so they carry over
+        # between the pdfs of regular and live builds.
+        if pdf_filename != self.pdf_filename or pdf_date != self.pdf_date:
+            self.previous_fingerprints.update(self.fingerprints)
+            self.fingerprints = dict()
+
+        changed = (color != self.color or self.layout == None or layout.scale_factor != self.layout.scale_factor)
+        self.visible_pages = visible_pages
+        self.visible_pages_additional = visible_pages_additional
+        self.layout = layout
+        self.pdf_filename = pdf_filename
+        self.pdf_date = pdf_date
+        self.color = color
         if changed:
             self.add_change_code('rendered_pages_changed')
 
-        scale_factor = self.preview.layout.scale_factor
-
-        for page_number in range(0, self.preview.poppler_document.get_n_pages()):
-            if page_number not in self.rendered_pages or self.rendered_pages[page_number][1] != page_width or self.rendered_pages[page_number][2] != pdf_date:
-                with self.page_render_count_lock:
-                    try:
-                        self.page_render_count[page_number] += 1
-                    except KeyError:
-                        self.page_render_count[page_number] = 1
-
-                    render_task = dict()
-                    render_task['page_number'] = page_number
-                    render_task['render_count'] = self.page_render_count[page_number]
-                    render_task['scale_factor'] = scale_factor
-                    render_task['hidpi_factor'] = hidpi_factor
-                    render_task['page_width'] = page_width
-                    render_task['page_height'] = page_height
-                    render_task['pdf_date'] = pdf_date
-                    render_task['matching_theme_colors'] = colors
-
-                    if visible_pages != None and page_number >= visible_pages[0] and page_number <= visible_pages[1]:
-                        self.render_queue.put(render_task)
-                    elif page_number >= visible_pages_additional[0] and page_number <= visible_pages_additional[1]:
-                        self.render_queue_low_priority.put(render_task)
+        viewport_width = view_width * hidpi_factor
+        viewport_height = view_height * hidpi_factor
+
+        tasks = list()
+        for page_number in range(visible_pages_additional[0], visible_pages_additional[1] + 1):
+            is_visible = (page_number >= visible_pages[0] and page_number <= visible_pages[1])
+            viewport_x = (self.preview.view.content.scrolling_offset_x - layout.get_horizontal_margin(view_width, page_number)) * hidpi_factor
+            viewport_y = (offset - layout.get_page_offset(page_number)) * hidpi_factor
+            page_key = self.get_page_key(page_number)
+
+            if page_key == None:
+                render_task = dict()
+                render_task['type'] = 'fingerprint'
+                render_task['key'] = ('fingerprint', self.pdf_filename, self.pdf_date, page_number)
+                render_task['page_number'] = page_number
+                render_task['pdf_filename'] = self.pdf_filename
+                render_task['pdf_date'] = self.pdf_date
+                tasks.append((0 if is_visible else 2, render_task))
+                continue
+
+            for tile_x, tile_y, x, y, width, height in self.get_tiles(page_number):
+                key = (page_key, self.get_page_size(page_number)[0], tile_x, tile_y)
+                if PreviewSurfaceCache.contains(key): continue
+
+                if not is_visible:
+                    priority = 2
+                elif x < viewport_x + viewport_width and x + width > viewport_x and y < viewport_y + viewport_height and y + height > viewport_y:
+                    priority = 0
+                else:
+                    priority = 1
+
+                render_task = dict()
+                render_task['type'] = 'tile'
+                render_task['key'] = key
+                render_task['page_number'] = page_number
+                render_task['rectangle'] = (x, y, width, height)
+                render_task['scale_factor'] = layout.scale_factor
+                render_task['hidpi_factor'] = hidpi_factor
+                render_task['pdf_filename'] = self.pdf_filename
+                render_task['pdf_date'] = self.pdf_date
+                render_task['color'] = color
+                tasks.append((priority, render_task))
+
+        with self.tiles_lock:
+            queued_tiles = dict()
+            for priority, render_task in tasks:
+                key = render_task['key']
+                if key in self.tiles_in_progress: continue
+
+                queued_tiles[key] = priority
+                if self.queued_tiles.get(key) != priority:
+                    self.render_queue.put((priority, next(self.task_count), render_task))
+            self.queued_tiles = queued_tiles
 
 
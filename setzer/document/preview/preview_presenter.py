@@ -85,21 +85,21 @@ class PreviewPresenter(object):
 
         self.draw_background(ctx, drawing_area)
 
-        page_height = self.preview.layout.page_height
-        page_gap = self.preview.layout.page_gap
-        margin = self.preview.layout.get_horizontal_margin(width)
+        layout = self.preview.layout
         scrolling_offset_x = self.view.content.scrolling_offset_x
         scrolling_offset_y = self.view.content.scrolling_offset_y
-        first_page = int(scrolling_offset_y // (page_height + page_gap))
-        last_page = min(int((scrolling_offset_y + height + 1) // (page_height + page_gap)), self.preview.poppler_document.get_n_pages() - 1)
-        ctx.transform(cairo.Matrix(1, 0, 0, 1, margin - scrolling_offset_x, first_page * (page_height + page_gap) - scrolling_offset_y))
+        first_page = layout.get_page_number_by_offset(scrolling_offset_y)
+        last_page = layout.get_page_number_by_offset(scrolling_offset_y + height + 1)
 
         for page_number in range(first_page, last_page + 1):
-            self.draw_page_background_and_outline(ctx)
+            ctx.save()
+            ctx.translate(layout.get_horizontal_margin(width, page_number) - scrolling_offset_x, layout.get_page_offset(page_number) - scrolling_offset_y)
+
+            self.draw_page_background_and_outline(ctx, page_number)
             self.draw_rendered_page(ctx, page_number)
             self.draw_synctex_rectangles(ctx, page_number)
 
-            ctx.transform(cairo.Matrix(1, 0, 0, 1, 0, page_height + self.preview.layout.page_gap))
+            ctx.restore()
 
     def draw_background(self, ctx, drawing_area):
         ctx.rectangle(0, 0, drawing_area.get_allocated_width(), drawing_area.get_allocated_height())
@@ -107,36 +107,46 @@ class PreviewPresenter(object):
         ctx.fill()
 
     #@timer
-    def draw_page_background_and_outline(self, ctx):
+    def draw_page_background_and_outline(self, ctx, page_number):
+        page_width, page_height = self.preview.layout.get_page_size(page_number)
+        border_width = self.preview.layout.border_width
+
         Gdk.cairo_set_source_rgba(ctx, ColorManager.get_ui_color('borders'))
-        ctx.rectangle(- self.preview.layout.border_width, - self.preview.layout.border_width, self.preview.layout.page_width + 2 * self.preview.layout.border_width, self.preview.layout.page_height + 2 * self.preview.layout.border_width)
+        ctx.rectangle(- border_width, - border_width, page_width + 2 * border_width, page_height + 2 * border_width)
         ctx.fill()
 
         if self.preview.recolor_pdf:
             Gdk.cairo_set_source_rgba(ctx, ColorManager.get_ui_color('view_bg_color'))
         else:
             ctx.set_source_rgba(1, 1, 1, 1)
-        ctx.rectangle(0, 0, self.preview.layout.page_width, self.preview.layout.page_height)
+        ctx.rectangle(0, 0, page_width, page_height)
         ctx.fill()
 
     def draw_rendered_page(self, ctx, page_number):
-        if not page_number in self.page_renderer.rendered_pages: return
-
-        rendered_page_data = self.page_renderer.rendered_pages[page_number]
-        surface = rendered_page_data[0]
-        page_width = rendered_page_data[1] * self.preview.layout.hidpi_factor
-
-        if not isinstance(surface, cairo.ImageSurface): return
-
-        matrix = ctx.get_matrix()
-        factor = self.preview.layout.page_width / page_width
-        ctx.scale(factor, factor)
-
-        ctx.set_source_surface(surface, 0, 0)
-        ctx.rectangle(0, 0, self.preview.layout.page_width / factor, self.preview.layout.page_height / factor)
-        ctx.fill()
+        page_width, page_height = self.preview.layout.get_page_size(page_number)
+        covered_rectangles = list()
+
+        for width, rendered_tiles in self.page_renderer.get_rendered_tiles(page_number):
+            factor = page_width / width
+            ctx.save()
+
+            # recolored tiles are transparent, so scaled ones mustn't show below sharp ones
+            if len(covered_rectangles) > 0:
+                ctx.set_fill_rule(cairo.FillRule.EVEN_ODD)
+                ctx.rectangle(0, 0, page_width, page_height)
+                for rectangle in covered_rectangles:
+                    ctx.rectangle(*rectangle)
+                ctx.clip()
+            ctx.scale(factor, factor)
+
+            for x, y, surface in rendered_tiles:
+                ctx.set_source_surface(surface, x, y)
+                ctx.get_source().set_extend(cairo.Extend.PAD)
+                ctx.rectangle(x, y, surface.get_width(), surface.get_height())
+                ctx.fill()
+                covered_rectangles.append((x * factor, y * factor, surface.get_width() * factor, surface.get_height() * factor))
 
-        ctx.set_matrix(matrix)
+            ctx.restore()
 
     def draw_synctex_rectangles(self, ctx, page_number):
         try:
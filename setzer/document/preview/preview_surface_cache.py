@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+from collections import OrderedDict
+
+
+class PreviewSurfaceCache():
+    ''' Rendered tiles of all open documents, shared between their
+        previews and limited to maximum_bytes in total. When the limit
+        is reached, the tiles that were used least recently go first.
+
+        Keys are (page_key, width, tile_x, tile_y), where width is the
+        width of the rendered page in device pixels. Tiles of the same
+        page at other zoom levels can be looked up by page_key, so a
+        page can be drawn scaled while it renders at a new size. '''
+
+    maximum_bytes = 256 * 1024 * 1024
+    surfaces = OrderedDict()
+    number_of_bytes = 0
+    tiles_by_page = dict()
+
+    def get(key):
+        try:
+            surface = PreviewSurfaceCache.surfaces[key]
+        except KeyError:
+            return None
+        PreviewSurfaceCache.surfaces.move_to_end(key)
+        return surface
+
+    def contains(key):
+        return key in PreviewSurfaceCache.surfaces
+
+    def add(key, surface):
+        PreviewSurfaceCache.remove(key)
+
+        page_key, width, tile_x, tile_y = key
+        PreviewSurfaceCache.surfaces[key] = surface
+        PreviewSurfaceCache.number_of_bytes += PreviewSurfaceCache.get_size(surface)
+        tiles_by_width = PreviewSurfaceCache.tiles_by_page.setdefault(page_key, dict())
+        tiles_by_width.setdefault(width, set()).add((tile_x, tile_y))
+
+        while PreviewSurfaceCache.number_of_bytes > PreviewSurfaceCache.maximum_bytes and len(PreviewSurfaceCache.surfaces) > 1:
+            PreviewSurfaceCache.remove(next(iter(PreviewSurfaceCache.surfaces)))
+
+    def remove(key):
+        try:
+            surface = PreviewSurfaceCache.surfaces.pop(key)
+        except KeyError:
+            return
+
+        page_key, width, tile_x, tile_y = key
+        PreviewSurfaceCache.number_of_bytes -= PreviewSurfaceCache.get_size(surface)
+        tiles_by_width = PreviewSurfaceCache.tiles_by_page[page_key]
+        tiles_by_width[width].discard((tile_x, tile_y))
+        if len(tiles_by_width[width]) == 0:
+            del(tiles_by_width[width])
+            if len(tiles_by_width) == 0:
+                del(PreviewSurfaceCache.tiles_by_page[page_key])
+
+    def get_tiles_by_width(page_key):
+        ''' Returns {width: {(tile_x, tile_y), ...}} for the cached
+            tiles of a page. '''
+
+        return PreviewSurfaceCache.tiles_by_page.get(page_key, dict())
+
+    def get_size(surface):
+        return surface.get_stride() * surface.get_height()
+
+
@@ -107,7 +107,7 @@ class PreviewZoomManager(Observable):
         factor = zoom_level / self.zoom_level
 
         x = factor * self.view.content.scrolling_offset_x + (factor - 1) * self.view.content.width / 2
-        prev_pages = self.view.content.scrolling_offset_y // (layout.page_height + layout.page_gap)
+        prev_pages = layout.get_page_number_by_offset(self.view.content.scrolling_offset_y)
         y = (1 - factor) * prev_pages * layout.page_gap + factor * self.view.content.scrolling_offset_y
 
         self.set_zoom_level(zoom_level)
@@ -58,6 +58,9 @@ class UpdateMatchingBlocks(object):
         return False
 
     def handle_keypress_inside_begin_or_end(self, keyval):
+        # block offsets are from the last published parse, they may be off.
+        if not self.document.parser.is_up_to_date(): return False
+
         buffer = self.source_buffer
         insert_iter = buffer.get_iter_at_mark(buffer.get_insert())
         line = self.document.get_line(insert_iter.get_line())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import re
+
+
+class BibTeXScanner():
+    ''' Finds the entries of a BibTeX file without building a database
+        of them. Yields one dict per entry with its type, key, start and
+        end offset and the values of the requested fields (for example
+        title and author). @string, @preamble and @comment are skipped.
+
+        Files are read in chunks, only the current entry is kept in
+        memory. An entry that is never closed ends where a line starts
+        with the next @type{ ... '''
+
+    entry_start_regex = re.compile(r'@[ \t\r\n]*(\w+)[ \t\r\n]*([{(])')
+    entry_body_regex = re.compile(r'[{}()"]|\n[ \t]*@(?=\w+[ \t]*[{(])')
+    entry_body_with_fields_regex = re.compile(r'[{}()",]|\n[ \t]*@(?=\w+[ \t]*[{(])')
+    bare_value_regex = re.compile(r'[^\s,#{}()"]*')
+    invalid_key_regex = re.compile(r'[\s=]')
+    braces_regex = re.compile(r'[{}]')
+    quotes_regex = re.compile(r'[{}"]')
+    whitespace_regex = re.compile(r'\s*')
+
+    def __init__(self, fields=None):
+        self.fields = set(fields) if fields != None else set()
+        if len(self.fields) > 0:
+            self.entry_body_regex = self.entry_body_with_fields_regex
+
+    def scan_file(self, filehandle, chunk_size=65536):
+        buffer = ''
+        buffer_offset = 0
+        position = 0
+        is_final = False
+        while True:
+            status, entry, position = self.scan_entry(buffer, position, is_final)
+            if status == 'entry':
+                if entry['key'] != None:
+                    entry['start'] += buffer_offset
+                    entry['end'] += buffer_offset
+                    yield entry
+            elif status == 'more':
+                buffer = buffer[position:]
+                buffer_offset += position
+                position = 0
+                chunk = filehandle.read(chunk_size)
+                is_final = (chunk == '')
+                buffer += chunk
+            else:
+                break
+
+    def scan_text(self, text, offset=0):
+        position = 0
+        while True:
+            status, entry, position = self.scan_entry(text, position, True)
+            if status == 'entry':
+                if entry['key'] != None:
+                    entry['start'] += offset
+                    entry['end'] += offset
+                    yield entry
+            else:
+                break
+
+    def scan_entry(self, text, position, is_final):
+        ''' Looks for the next entry in text, starting at position.
+            Returns (status, entry, position): status 'entry' with the
+            entry (key None for @string etc.) and the offset behind it,
+            'more' if text ends within the entry, with the offset to
+            continue from, or 'done'. '''
+
+        match = self.entry_start_regex.search(text, position)
+        if match == None:
+            if is_final: return ('done', None, len(text))
+            at_position = text.rfind('@', position)
+            return ('more', None, at_position if at_position >= 0 else len(text))
+
+        closing_char = '}' if match.group(2) == '{' else ')'
+        depth = 0
+        in_quotes = False
+        end = None
+        separators = list()
+        for token in self.entry_body_regex.finditer(text, match.end()):
+            char = token.group(0)
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                if depth == 0 and closing_char == '}':
+                    end = token.start()
+                    break
+                depth = max(depth - 1, 0)
+            elif char == ',':
+                if depth == 0 and not in_quotes:
+                    separators.append(token.start())
+            elif char == ')':
+                if depth == 0 and not in_quotes and closing_char == ')':
+                    end = token.start()
+                    break
+            elif char == '"':
+                if depth == 0:
+                    in_quotes = not in_quotes
+            elif char != '(':
+                # a line starting with the next entry, this one isn't closed
+                end = token.start()
+                break
+
+        if end == None:
+            if not is_final: return ('more', None, match.start())
+            end = len(text)
+        is_closed = (end < len(text) and text[end] == closing_char)
+        next_position = end + 1 if is_closed else end
+
+        entry = {'type': match.group(1).lower(), 'key': None, 'start': match.start(), 'end': next_position, 'is_closed': is_closed, 'fields': dict()}
+        if entry['type'] in ['string', 'preamble', 'comment']:
+            return ('entry', entry, next_position)
+
+        if len(self.fields) == 0:
+            comma_position = text.find(',', match.end(), end)
+            separators = [comma_position] if comma_position >= 0 else []
+        key_end = separators[0] if len(separators) > 0 else end
+        key = text[match.end():key_end].strip()
+        if key == '' or self.invalid_key_regex.search(key) != None:
+            return ('entry', entry, next_position)
+        entry['key'] = key
+
+        if len(self.fields) > 0:
+            separators.append(end)
+            for field_start, field_end in zip(separators, separators[1:]):
+                equals_position = text.find('=', field_start + 1, field_end)
+                if equals_position < 0: continue
+                name = text[field_start + 1:equals_position].strip().lower()
+                if name in self.fields:
+                    value = self.get_value(text[equals_position + 1:field_end])
+                    entry['fields'][name] = ' '.join(value.split())
+        return ('entry', entry, next_position)
+
+    def get_value(self, text):
+        ''' Reads a field value: braced or quoted strings, numbers and
+            macro names, concatenated with #. '''
+
+        parts = list()
+        position = 0
+        while True:
+            position = self.whitespace_regex.match(text, position).end()
+            if position >= len(text): break
+
+            char = text[position]
+            if char == '{':
+                end = self.get_closing_position(text, position + 1, self.braces_regex, '}')
+                parts.append(text[position + 1:end])
+                position = end + 1
+            elif char == '"':
+                end = self.get_closing_position(text, position + 1, self.quotes_regex, '"')
+                parts.append(text[position + 1:end])
+                position = end + 1
+            else:
+                match = self.bare_value_regex.match(text, position)
+                parts.append(match.group(0))
+                position = max(match.end(), position + 1)
+
+            position = self.whitespace_regex.match(text, position).end()
+            if position < len(text) and text[position] == '#':
+                position += 1
+            else:
+                break
+        return ''.join(parts)
+
+    def get_closing_position(self, text, position, regex, closing_char):
+        depth = 0
+        for match in regex.finditer(text, position):
+            char = match.group(0)
+            if char == '{':
+                depth += 1
+            elif depth == 0 and char == closing_char:
+                return match.start()
+            elif char == '}':
+                depth = max(depth - 1, 0)
+        return len(text)
+
+
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import bisect, heapq
+
+
+class PrefixIndex():
+    ''' Keeps texts in a sorted array, so the texts starting with a
+        prefix can be found by bisection. Matching ignores case.
+
+        A text can be added several times (for example a label defined
+        in two files), it stays in the index until it has been removed
+        as often. Ranked indexes return the lowest ranks first, others
+        return matches in alphabetical order. '''
+
+    def __init__(self, ranked=False):
+        self.ranked = ranked
+        self.keys = list()
+        self.counts = dict()
+        self.items = dict()
+
+    def add(self, text, item=None, rank=0):
+        if text in self.counts:
+            self.counts[text] += 1
+        else:
+            self.counts[text] = 1
+            self.items[text] = (rank, item if item != None else text)
+            bisect.insort(self.keys, (text.lower(), text))
+
+    def remove(self, text):
+        if text not in self.counts: return
+
+        self.counts[text] -= 1
+        if self.counts[text] == 0:
+            del(self.counts[text])
+            del(self.items[text])
+            index = bisect.bisect_left(self.keys, (text.lower(), text))
+            del(self.keys[index])
+
+    def update(self, removed_texts, added_texts):
+        ''' Removes and adds many texts at once. Large changes resort
+            the whole array instead of moving it for each text. '''
+
+        if len(removed_texts) + len(added_texts) < max(32, len(self.keys) // 16):
+            for text in removed_texts:
+                self.remove(text)
+            for text in added_texts:
+                self.add(text)
+            return
+
+        for text in removed_texts:
+            if text in self.counts:
+                self.counts[text] -= 1
+                if self.counts[text] == 0:
+                    del(self.counts[text])
+                    del(self.items[text])
+        for text in added_texts:
+            if text in self.counts:
+                self.counts[text] += 1
+            else:
+                self.counts[text] = 1
+                self.items[text] = (0, text)
+        self.keys = sorted((text.lower(), text) for text in self.counts)
+
+    def get_items(self, prefix, limit=None):
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.keys, (prefix,))
+        end = bisect.bisect_left(self.keys, (prefix + '\U0010ffff',), start)
+
+        if self.ranked:
+            if limit != None and end - start > limit:
+                keys = heapq.nsmallest(limit, self.keys[start:end], key=lambda key: self.items[key[1]][0])
+            else:
+                keys = sorted(self.keys[start:end], key=lambda key: self.items[key[1]][0])
+        else:
+            keys = self.keys[start:end if limit == None else min(end, start + limit)]
+        return [self.items[key[1]][1] for key in keys]
+
+    def __len__(self):
+        return len(self.counts)
+
+
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright (C) 2017-present Robert Griesel
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+
+import numpy as np
+
+
+class SurfaceRecolor():
+    ''' Recolors rendered pages for dark mode, in place on the buffer of
+        a cairo ARGB32 image surface.
+
+        Dark pixels become opaque in the given color, light pixels
+        become transparent, so the page background shows through.
+        The surface is processed in bands of band_height rows, all
+        intermediate values live in scratch buffers for one band that
+        are allocated once and grow with the widest surface seen. '''
+
+    def __init__(self):
+        self.band_height = 64
+        self.luminance = np.empty(0, dtype=np.uint16)
+        self.scratch = np.empty(0, dtype=np.uint16)
+        self.indices = np.empty(0, dtype=np.intp)
+        self.color = None
+        self.lookup_table = None
+
+    def recolor(self, surface, color):
+        ''' color is an (r, g, b, a) tuple of floats between 0 and 1. '''
+
+        width, height, stride = surface.get_width(), surface.get_height(), surface.get_stride()
+        if width == 0 or height == 0: return
+
+        surface.flush()
+        # cairo stores premultiplied pixels as native 32 bit integers
+        # 0xAARRGGBB, on little endian machines the bytes are B, G, R, A.
+        data = surface.get_data()
+        pixels = np.ndarray((height, stride // 4), dtype=np.uint32, buffer=data)[:, :width]
+        channels = np.ndarray((height, stride // 4, 4), dtype=np.uint8, buffer=data)[:, :width]
+        if np.little_endian:
+            blue, green, red = channels[..., 0], channels[..., 1], channels[..., 2]
+        else:
+            red, green, blue = channels[..., 1], channels[..., 2], channels[..., 3]
+
+        lookup_table = self.get_lookup_table(color)
+        for start in range(0, height, self.band_height):
+            end = min(start + self.band_height, height)
+            luminance, scratch, indices = self.get_scratch_buffers(width, end - start)
+
+            # numpy 1.x would multiply in uint8 and wrap, dtype widens first.
+            np.multiply(red[start:end], np.uint16(77), out=luminance, dtype=np.uint16)
+            np.multiply(green[start:end], np.uint16(150), out=scratch, dtype=np.uint16)
+            np.add(luminance, scratch, out=luminance)
+            np.multiply(blue[start:end], np.uint16(29), out=scratch, dtype=np.uint16)
+            np.add(luminance, scratch, out=luminance)
+            np.right_shift(luminance, 8, out=indices)
+
+            # luminance is at most 255 now, look up the recolored pixel
+            np.take(lookup_table, indices, out=pixels[start:end], mode='clip')
+
+        surface.mark_dirty()
+
+    def get_scratch_buffers(self, width, height):
+        size = width * height
+        if self.luminance.size < size:
+            self.luminance = np.empty(size, dtype=np.uint16)
+            self.scratch = np.empty(size, dtype=np.uint16)
+            self.indices = np.empty(size, dtype=np.intp)
+        return (self.luminance[:size].reshape(height, width), self.scratch[:size].reshape(height, width), self.indices[:size].reshape(height, width))
+
+    def get_lookup_table(self, color):
+        if color != self.color:
+            alpha = (255 - np.arange(256, dtype=np.float64)) * color[3]
+            red, green, blue = (np.round(alpha * value).astype(np.uint32) for value in color[:3])
+            self.lookup_table = (np.round(alpha).astype(np.uint32) << 24) | (red << 16) | (green << 8) | blue
+            self.color = color
+        return self.lookup_table
+
+
@@ -56,6 +56,7 @@ class ShortcutControllerApp(ShortcutController):
         self.create_and_add_shortcut('F2', self.shortcut_document_structure_toggle)
         self.create_and_add_shortcut('F3', self.shortcut_symbols_toggle)
         self.create_and_add_shortcut('F5', self.actions.save_and_build)
+        self.create_and_add_shortcut('<Shift>F5', self.actions.save_and_build_chapter)
         self.create_and_add_shortcut('F6', self.actions.build)
         self.create_and_add_shortcut('F7', self.actions.forward_sync)
         self.create_and_add_shortcut('F8', self.shortcut_build_log)
@@ -72,6 +72,8 @@ class Settings(Observable):
         self.defaults['preferences']['autoshow_build_log'] = 'errors_warnings'
         self.defaults['preferences']['latex_interpreter'] = 'xelatex'
         self.defaults['preferences']['use_latexmk'] = False
+        self.defaults['preferences']['use_precompiled_preamble'] = False
+        self.defaults['preferences']['live_preview'] = False
         self.defaults['preferences']['color_scheme'] = 'default'
         self.defaults['preferences']['recolor_pdf'] = False
         self.defaults['preferences']['spaces_instead_of_tabs'] = True
@@ -38,6 +38,7 @@ class Actions(object):
         self.add_action('open-document-dialog', self.open_document_dialog)
         self.add_action('build', self.build)
         self.add_action('save-and-build', self.save_and_build)
+        self.add_action('save-and-build-chapter', self.save_and_build_chapter)
         self.add_action('show-build-log', self.show_build_log)
         self.add_action('close-build-log', self.close_build_log)
         self.add_action('save', self.save)
@@ -181,6 +182,7 @@ class Actions(object):
         self.actions['forward-sync'].set_enabled(can_sync)
         self.actions['build'].set_enabled(can_build)
         self.actions['save-and-build'].set_enabled(can_build)
+        self.actions['save-and-build-chapter'].set_enabled(can_build)
         self.actions['show-build-log'].set_enabled(document_active_is_latex)
         self.actions['close-build-log'].set_enabled(document_active_is_latex)
         self.actions['reset-zoom'].set_enabled(can_reset_zoom)
@@ -213,6 +215,19 @@ class Actions(object):
             self.save()
             document.build_system.build_and_forward_sync(active_document)
 
+    def save_and_build_chapter(self, action=None, parameter=None):
+        if self.workspace.get_active_document() == None: return
+
+        document = self.workspace.get_root_or_active_latex_document()
+        active_document = ServiceLocator.get_workspace().get_active_document()
+        if document == None or active_document == None: return
+
+        if document.filename == None:
+            DialogLocator.get_dialog('build_save').run(document)
+        else:
+            self.save()
+            document.build_system.fast_build_and_forward_sync(active_document)
+
     def build(self, action=None, parameter=None):
         if self.workspace.get_active_document() == None: return
 
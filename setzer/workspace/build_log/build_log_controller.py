@@ -20,6 +20,7 @@ gi.require_version('Gtk', '4.0')
 from gi.repository import Gdk
 from gi.repository import Gtk
 
+from setzer.dialogs.dialog_locator import DialogLocator
 
 class BuildLogController(object):
     
@@ -38,6 +39,13 @@ class BuildLogController(object):
         motion_controller.connect('leave', self.on_leave)
         self.view.list.add_controller(motion_controller)
 
+        self.view.export_profiles_button.connect('clicked', self.on_export_profiles_button_clicked)
+
+    def on_export_profiles_button_clicked(self, button):
+        if self.build_log.document == None: return
+
+        DialogLocator.get_dialog('export_build_profiles').run(self.build_log.document)
+
     def on_enter(self, controller, x, y):
         self.update_hover_state(y)
 
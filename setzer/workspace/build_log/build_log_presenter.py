@@ -22,6 +22,7 @@ from gi.repository import Gdk
 from gi.repository import Pango
 
 import os.path
+import time
 
 import setzer.workspace.build_log.build_log_viewgtk as build_log_view
 import setzer.helpers.drawing as drawing_helper
@@ -39,6 +40,7 @@ class BuildLogPresenter(object):
 
         self.build_log.connect('build_log_finished_adding', self.on_build_log_finished_adding)
         self.build_log.connect('hover_item_changed', self.on_hover_item_changed)
+        self.view.profile_button.connect('toggled', self.on_profile_button_toggled)
         self.view.scrolled_window.get_vadjustment().connect('value-changed', self.on_scroll)
 
     def on_scroll(self, adjustment, *arguments):
@@ -55,6 +57,13 @@ class BuildLogPresenter(object):
         height = len(self.view.list.items) * self.view.list.line_height + 24
         self.view.list.set_size_request(354 + self.view.list.layouts[3].get_extents()[0].width / Pango.SCALE, height)
         self.update_list()
+        self.update_build_profiles()
+
+    def on_profile_button_toggled(self, button):
+        if button.get_active():
+            self.view.stack.set_visible_child_name('timings')
+        else:
+            self.view.stack.set_visible_child_name('items')
 
     def on_hover_item_changed(self, build_log):
         self.view.list.hover_item = build_log.hover_item
@@ -63,9 +72,47 @@ class BuildLogPresenter(object):
     def update_list(self):
         self.view.list.queue_draw()
 
+    def update_build_profiles(self):
+        build_profiles = self.build_log.document.build_system.build_profiles if self.build_log.document != None else []
+        self.view.export_profiles_button.set_sensitive(len(build_profiles) > 0)
+        if len(build_profiles) == 0:
+            self.view.profile_label.set_text(_('No timings yet, they are taken while building.'))
+            return
+
+        last_build = build_profiles[-1]
+        text = self.get_build_profile_summary(last_build) + '\n\n'
+        text += '{:<32}{:>10}{:>10}{:>12}{:>12}\n'.format(_('Stage'), _('Wall'), _('CPU'), _('Children'), _('Peak RSS'))
+        for span in last_build['spans']:
+            text += '{:<32}{:>10}{:>10}{:>12}{:>12}\n'.format(('  ' * span['depth'] + span['name'])[:31],
+                                                          self.format_seconds(span['wall_time']),
+                                                          self.format_seconds(span['cpu_time']),
+                                                          self.format_seconds(span['child_cpu_time']),
+                                                          '{:.0f} MB'.format(span['max_child_rss'] / 1048576) if span['max_child_rss'] != None else '')
+
+        if len(build_profiles) > 1:
+            text += '\n' + _('Earlier builds') + '\n'
+            for build_profile in reversed(build_profiles[:-1]):
+                text += self.get_build_profile_summary(build_profile) + '\n'
+        self.view.profile_label.set_text(text.rstrip())
+
+    def get_build_profile_summary(self, build_profile):
+        summary = time.strftime('%H:%M:%S', time.localtime(build_profile['start_time'])) + '  '
+        summary += os.path.basename(build_profile['filename']) + '  ' + self.format_seconds(build_profile['wall_time'])
+        if build_profile['cached']:
+            summary += '  (' + _('reused last build') + ')'
+        elif build_profile['error'] != None:
+            summary += '  (' + _('failed') + ')'
+        return summary
+
+    def format_seconds(self, seconds):
+        if seconds == None: return ''
+        return '{:.2f}s'.format(seconds)
+
     def set_header_data(self, errors, warnings, tried_building=False):
         if tried_building:
-            if self.build_log.document.build_system.build_time != None:
+            if self.build_log.document.build_system.build_was_cached:
+                time_string = _('inputs unchanged, reused last build') + ', '
+            elif self.build_log.document.build_system.build_time != None:
                 time_string = '{:.2f}s, '.format(self.build_log.document.build_system.build_time)
             else:
                 time_string = ''
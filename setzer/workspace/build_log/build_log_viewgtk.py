@@ -42,6 +42,37 @@ class BuildLogView(Gtk.Box):
         self.scrolled_window.set_vexpand(True)
         self.scrolled_window.set_child(self.list)
 
+        self.profile_label = Gtk.Label()
+        self.profile_label.set_xalign(0)
+        self.profile_label.set_yalign(0)
+        self.profile_label.set_selectable(True)
+        self.profile_label.get_style_context().add_class('monospace')
+
+        self.export_profiles_button = Gtk.Button.new_with_label(_('Export as JSON') + '…')
+        self.export_profiles_button.set_halign(Gtk.Align.START)
+        self.export_profiles_button.set_can_focus(False)
+
+        self.profile_box = Gtk.Box.new(Gtk.Orientation.VERTICAL, 12)
+        self.profile_box.set_margin_start(12)
+        self.profile_box.set_margin_top(6)
+        self.profile_box.set_margin_bottom(12)
+        self.profile_box.append(self.profile_label)
+        self.profile_box.append(self.export_profiles_button)
+
+        self.profile_scrolled_window = Gtk.ScrolledWindow()
+        self.profile_scrolled_window.set_vexpand(True)
+        self.profile_scrolled_window.set_child(self.profile_box)
+
+        self.stack = Gtk.Stack()
+        self.stack.add_named(self.scrolled_window, 'items')
+        self.stack.add_named(self.profile_scrolled_window, 'timings')
+
+        self.profile_button = Gtk.ToggleButton()
+        self.profile_button.set_icon_name('document-open-recent-symbolic')
+        self.profile_button.set_tooltip_text(_('Build timings'))
+        self.profile_button.get_style_context().add_class('flat')
+        self.profile_button.set_can_focus(False)
+
         self.close_button = Gtk.Button.new_from_icon_name('window-close-symbolic')
         self.close_button.get_style_context().add_class('flat')
         self.close_button.set_can_focus(False)
@@ -55,10 +86,11 @@ class BuildLogView(Gtk.Box):
 
         self.header = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 0)
         self.header.append(self.header_label)
+        self.header.append(self.profile_button)
         self.header.append(self.close_button)
 
         self.append(self.header)
-        self.append(self.scrolled_window)
+        self.append(self.stack)
         self.set_size_request(200, 200)
 
 